@@ -0,0 +1,292 @@
+"""
+Benchmarks for the Alameda Police Data build.
+
+Each benchmark times one build step on synthetic data (see synth.py) at
+one or more row counts. Every case runs in a fresh process, so peak RSS
+belongs to that case alone. Setup (data generation, seeding caches) is
+not timed.
+
+    etl       load_and_clean_xlsx over synthetic raw workbooks
+    geocode   geocode_addresses against a seeded SQLite cache; the ~5% of
+              addresses left out go to the offline StubBackend
+    charts    build_charts (forced redraw) and a second, cached call
+    heatmap   build_heatmap
+    cube      build_cube plus the dashboard's cube slices and hotspot queries
+    query     IncidentIndex build plus time / type / area / bbox drill-downs
+    stream    stream_incidents (the --streaming build) over the raw workbooks
+              with a fully seeded geocode cache; peak RSS should stay flat
+              as rows grow
+
+Results report seconds, rows/s, CPU seconds and peak RSS. --save NAME
+stores them as bench/baselines/NAME.json. --compare NAME flags any case
+that got slower (or bigger) than the baseline by more than --tolerance,
+and exits 1 if any did. Timings only compare on the machine that
+recorded them, so baselines are local files (not committed) and
+--compare warns when the baseline came from a different environment.
+
+    python bench/run.py --rows 10000 100000 --save laptop
+    python bench/run.py --rows 10000 100000 --compare laptop
+
+Raw workbooks are cached under bench/.data per row count and seed, as
+writing xlsx dominates setup at 1M+ rows.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR))
+sys.path.insert(0, str(BENCH_DIR.parent / 'src'))
+import synth
+from metrics import measure
+
+BASELINE_DIR = BENCH_DIR / 'baselines'
+DATA_DIR = BENCH_DIR / '.data'
+DEFAULT_ROWS = [10_000, 100_000]
+CACHED_SHARE = 0.95  # share of distinct addresses already in the geocode cache
+STREAM_CHUNK = 20_000  # below one yearly workbook at 100k+ rows, so chunking is exercised
+
+
+def raw_workbooks(rows, seed):
+    """Directory of synthetic raw workbooks, written once per (rows, seed)."""
+    out = DATA_DIR / f'raw-{rows}-{seed}'
+    if not (out / 'done').exists():
+        raw, _ = synth.raw_frame(rows, seed)
+        synth.write_workbooks(raw, out)
+        (out / 'done').touch()
+    return out
+
+
+def bench_etl(rows, seed, workers, tmp):
+    from etl import load_and_clean_xlsx
+    raw_dir = raw_workbooks(rows, seed)
+    with measure('etl', rows_in=rows) as step:
+        df = load_and_clean_xlsx(raw_dir, workers=workers)
+        step['rows_out'] = len(df)
+    return [step]
+
+
+def bench_geocode(rows, seed, workers, tmp):
+    from address import canonicalize_series, encode_addresses, geocode_query
+    from geocache import GeocodeCache
+    from geocode import GeocodeEngine, StubBackend, geocode_addresses
+    raw, truth = synth.raw_frame(rows, seed)
+    answers = synth.geocodes(raw, truth)
+    df = encode_addresses(pd.DataFrame({'address': canonicalize_series(raw['Incident address'])}))
+    rng = np.random.default_rng(seed)
+    known = [a for a in answers if rng.random() < CACHED_SHARE]
+    seed_csv = Path(tmp) / 'seed.csv'
+    pd.DataFrame({'address': known, 'lat': [answers[a][0] for a in known],
+                  'lon': [answers[a][1] for a in known]}).to_csv(seed_csv, index=False)
+    with GeocodeCache(Path(tmp) / 'geocode_cache.sqlite') as cache:
+        cache.import_csv(seed_csv, backend='nominatim')
+        # The engine asks for full queries (address plus locality)
+        engine = GeocodeEngine(StubBackend(results={geocode_query(a): ll for a, ll in answers.items()}), workers=4)
+        with measure('geocode', rows_in=rows) as step:
+            out = geocode_addresses(df, cache, engine=engine)
+            step['rows_out'] = int(out['lat'].notna().sum())
+    return [step]
+
+
+def bench_charts(rows, seed, workers, tmp):
+    from vis import build_charts
+    df = synth.clean_frame(rows, seed)
+    steps = []
+    for name, force in (('charts', True), ('charts_cached', False)):
+        with measure(name, rows_in=rows) as step:
+            build_charts(df, Path(tmp) / 'charts', workers=workers, force=force)
+        steps.append(step)
+    return steps
+
+
+def bench_heatmap(rows, seed, workers, tmp):
+    from vis import build_heatmap
+    df = synth.clean_frame(rows, seed)
+    with measure('heatmap', rows_in=rows) as step:
+        build_heatmap(df, Path(tmp) / 'maps')
+    return [step]
+
+
+def bench_cube(rows, seed, workers, tmp):
+    from cube import build_cube, slice_cube
+    from spatial import HotspotIndex
+    df = synth.clean_frame(rows, seed)
+    steps = []
+    with measure('cube_build', rows_in=rows) as step:
+        cube = build_cube(df)
+        step['rows_out'] = len(cube)
+    steps.append(step)
+    groups = ('TRAFFIC', 'DISORDER')
+    with measure('cube_slices', rows_in=len(cube)) as step:
+        for by in (('year',), ('year', 'month'), ('month',), ('dow',), ('hour',), ('nature',), ('nature_grp',), ('month', 'hour')):
+            slice_cube(cube, by)
+            slice_cube(cube, by, groups)
+    steps.append(step)
+    with measure('hotspots', rows_in=rows) as step:
+        index = HotspotIndex.from_frame(df)
+        index.top(15)
+        index.top(15, groups=groups, start=2023, end=2024)
+        index.change((2021, 2021), (2024, 2024))
+        step['rows_out'] = len(index.bins)
+    steps.append(step)
+    return steps
+
+
+def bench_query(rows, seed, workers, tmp):
+    from query import IncidentIndex
+    df = synth.clean_frame(rows, seed)
+    steps = []
+    with measure('query_index', rows_in=rows) as step:
+        index = IncidentIndex(df)
+    steps.append(step)
+    lat, lon = float(df['lat'].median()), float(df['lon'].median())
+    with measure('query_lookups', rows_in=rows) as step:
+        found = 0
+        for year in range(2021, 2025):
+            window = (f'{year}-03-01', f'{year}-06-01')
+            found += len(index.query(*window))
+            found += len(index.query(*window, nature_grp=['TRAFFIC', 'DISORDER'], area='PD8'))
+            found += len(index.query(*window, bbox=(lon - 0.002, lon + 0.002, lat - 0.002, lat + 0.002)))
+            found += len(index.query(located=True, nature_grp='TRAFFIC', columns=['reported_dt', 'lat', 'lon']))
+            found += len(index.query(bbox=(lon, lon + 0.0005, lat, lat + 0.0005), columns=['reported_dt', 'address']))
+        step['rows_out'] = found
+    steps.append(step)
+    return steps
+
+
+def stream_cache(rows, seed, path):
+    """Write a geocode cache holding every synthetic address to path."""
+    from geocache import GeocodeCache
+    raw, truth = synth.raw_frame(rows, seed)
+    answers = synth.geocodes(raw, truth)
+    pd.DataFrame({'address': list(answers), 'lat': [v[0] for v in answers.values()],
+                  'lon': [v[1] for v in answers.values()]}).to_csv(path.with_suffix('.csv'), index=False)
+    with GeocodeCache(path) as cache:
+        cache.import_csv(path.with_suffix('.csv'), backend='nominatim')
+
+
+def bench_stream(rows, seed, workers, tmp):
+    from geocache import GeocodeCache
+    from geocode import GeocodeEngine, StubBackend
+    from store import IncidentWriter
+    from stream import stream_incidents
+    raw_dir = raw_workbooks(rows, seed)
+    # Seed the cache in another process so the raw frame does not count towards peak RSS
+    cache_path = Path(tmp) / 'geocode_cache.sqlite'
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+        pool.submit(stream_cache, rows, seed, cache_path).result()
+    with GeocodeCache(cache_path) as cache:
+        engine = GeocodeEngine(StubBackend(), workers=4)
+        with measure('stream', rows_in=rows) as step:
+            writer = IncidentWriter(Path(tmp) / 'incidents')
+            aggregates = stream_incidents(sorted(raw_dir.glob('20*.xlsx')), cache, engine, chunk_rows=STREAM_CHUNK,
+                                          writer=writer)
+            writer.close()
+            step['rows_out'] = aggregates.rows
+    return [step]
+
+
+BENCHMARKS = {
+    'etl': bench_etl,
+    'geocode': bench_geocode,
+    'charts': bench_charts,
+    'heatmap': bench_heatmap,
+    'cube': bench_cube,
+    'query': bench_query,
+    'stream': bench_stream,
+}
+
+
+def run_case(name, rows, seed, workers):
+    """One benchmark at one size, in the current (fresh) process."""
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        # Steps that write relative paths (e.g. cache/intersection_addresses.csv) stay in tmp
+        os.chdir(tmp)
+        (Path(tmp) / 'cache').mkdir()
+        steps = BENCHMARKS[name](rows, seed, workers, tmp)
+    results = []
+    for step in steps:
+        results.append({
+            'bench': step['name'], 'rows': rows, 'seconds': step['wall_s'], 'cpu_s': step['cpu_s'],
+            'rows_per_s': round(rows / step['wall_s']) if step['wall_s'] else None,
+            'peak_rss_mb': step['peak_rss_mb'], 'rss_growth_mb': step['rss_growth_mb'],
+        })
+    return results
+
+
+def environment():
+    return {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def compare(results, baseline, tolerance):
+    """Print each case against baseline; return the regressed cases."""
+    if baseline.get('environment') != environment():
+        print(f"warning: baseline was recorded on {baseline.get('environment')}, not {environment()}")
+    base = {(r['bench'], r['rows']): r for r in baseline['results']}
+    regressions = []
+    print(f"\n{'bench':<16}{'rows':>10}{'time x':>9}{'rss x':>8}")
+    for r in results:
+        b = base.get((r['bench'], r['rows']))
+        if b is None:
+            continue
+        t = r['seconds'] / b['seconds'] if b['seconds'] else float('nan')
+        m = r['peak_rss_mb'] / b['peak_rss_mb'] if b['peak_rss_mb'] else float('nan')
+        flag = '  REGRESSION' if t > 1 + tolerance or m > 1 + tolerance else ''
+        print(f"{r['bench']:<16}{r['rows']:>10,}{t:>9.2f}{m:>8.2f}{flag}")
+        if flag:
+            regressions.append(r)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the build on synthetic data.')
+    parser.add_argument('--bench', nargs='+', choices=sorted(BENCHMARKS), default=sorted(BENCHMARKS))
+    parser.add_argument('--rows', nargs='+', type=int, default=DEFAULT_ROWS,
+                        help='Row counts to run each benchmark at (10k to 10M).')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1, help='Workers passed to etl and charts.')
+    parser.add_argument('--save', metavar='NAME', help='Save results as bench/baselines/NAME.json.')
+    parser.add_argument('--compare', metavar='NAME', help='Compare against bench/baselines/NAME.json.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed slowdown / memory growth before a case counts as a regression.')
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'bench':<16}{'rows':>10}{'seconds':>10}{'rows/s':>12}{'peak MB':>9}")
+    for rows in args.rows:
+        for name in args.bench:
+            # A fresh process per case keeps peak RSS per case
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+                for r in pool.submit(run_case, name, rows, args.seed, args.workers).result():
+                    results.append(r)
+                    print(f"{r['bench']:<16}{r['rows']:>10,}{r['seconds']:>10.2f}"
+                          f"{r['rows_per_s'] or 0:>12,}{r['peak_rss_mb']:>9.0f}", flush=True)
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'environment': environment(),
+              'seed': args.seed, 'workers': args.workers, 'results': results}
+    if args.save:
+        BASELINE_DIR.mkdir(parents=True, exist_ok=True)
+        path = BASELINE_DIR / f'{args.save}.json'
+        path.write_text(json.dumps(report, indent=2))
+        print(f'\nSaved baseline {path}')
+    if args.compare:
+        baseline = json.loads((BASELINE_DIR / f'{args.compare}.json').read_text())
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""
+Synthetic Pocatello-style incident data for Alameda Police Data benchmarks.
+
+Incidents are placed on a street grid shaped like the Alameda
+neighbourhood: numbered-block avenues running north-south and named
+streets running east-west around lat 42.88, lon -112.445. Addresses mix
+house numbers with directionals, intersections, ';' business
+descriptors, unit numbers and spelled-out suffixes. Natures are drawn
+from nature_groups.md with a Zipf-like skew led by the real top codes,
+and timestamps mostly use the real export format with a configurable
+share in the other DATE_FORMATS.
+
+raw_frame() builds the raw export columns; write_workbooks() writes
+them as yearly .xlsx files, split at Excel's row limit;
+clean_frame() builds a cleaned, geocoded frame directly (no Excel
+round trip) for the chart, map and aggregation benchmarks.
+
+    python bench/synth.py data/synth/raw --rows 100000
+"""
+
+import argparse
+import logging
+import sys
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+from address import canonicalize_series, encode_addresses
+from etl import DATE_FORMATS, add_date_parts
+from nature import DEFAULT_RULES, load_rules, recode_nature
+
+EXCEL_MAX_ROWS = 1_048_576
+HEADER = ['Incident', 'Nature', 'Area', 'Agency', 'Reported', 'Incident address']
+REAL_FORMAT = '%H:%M:%S %m/%d/%y'
+YEARS = (2020, 2025)
+
+# North-south avenues, west to east, and east-west streets, south to north
+AVENUES = ['PARK', 'JEFFERSON', 'WASHINGTON', 'WAYNE', 'WARREN', 'RANDOLPH', 'WILLARD', 'GARFIELD']
+STREETS = ['E CENTER', 'E LEWIS', 'E LANDER', 'E CLARK', 'E HALLIDAY', 'E WALNUT', 'E CEDAR',
+           'E OAK', 'E PINE', 'E POPLAR', 'E YOUNG', 'E ALAMEDA']
+ORIGIN = (42.8700, -112.4520)  # lat/lon of the south-west corner
+BLOCK_LAT = 0.0018             # ~200 m between streets
+BLOCK_LON = 0.0024             # ~195 m between avenues
+DESCRIPTORS = ['LANDLINE', 'ALAMEDA PARK', 'COMMON CENTS', 'ALLEY BEHIND', 'FIVE CORNERS BAR', 'GAS STATION']
+SPELLED = {'ST': 'STREET', 'AVE': 'AVENUE'}
+# Most frequent codes in the real exports, most frequent first
+COMMON_NATURES = ['ANIMAL PROBLEM', 'WELFARE CHECK', 'SUSPICIOUS', 'DISTURBANCE', 'ABANDONED VEHIC', 'ACCIDENT',
+                  'HARASSMENT', 'THEFT', 'CODE ENFORCE', 'PARKING PROBLEM']
+
+
+def nature_codes(rules_path=DEFAULT_RULES, rng=None):
+    """Nature codes listed in nature_groups.md, most frequent first.
+
+    COMMON_NATURES lead in their observed order; the rest follow in
+    random order.
+    """
+    codes = sorted(load_rules(rules_path)['codes'])
+    head = [c for c in COMMON_NATURES if c in codes]
+    tail = [c for c in codes if c not in head]
+    if rng is not None:
+        rng.shuffle(tail)
+    return head + tail
+
+
+def _zipf_weights(n, s=1.1):
+    weights = 1.0 / np.arange(1, n + 1) ** s
+    return weights / weights.sum()
+
+
+def _streets():
+    """(name, suffix, is_avenue, index) for every street in the grid."""
+    return ([(a, 'AVE', True, i) for i, a in enumerate(AVENUES)]
+            + [(s, 'ST', False, i) for i, s in enumerate(STREETS)])
+
+
+def _locations(n, rng, intersection_share):
+    """Canonical-ish street addresses plus their true lat/lon."""
+    streets = _streets()
+    pick = rng.integers(0, len(streets), n)
+    # Position along the street, in blocks from the grid origin
+    along = rng.uniform(0, len(STREETS) - 1, n)
+    across = rng.uniform(0, len(AVENUES) - 1, n)
+    lat = np.empty(n)
+    lon = np.empty(n)
+    addresses = np.empty(n, dtype=object)
+    for k, (name, suffix, avenue, idx) in enumerate(streets):
+        rows = np.nonzero(pick == k)[0]
+        if avenue:
+            pos = along[rows]
+            lat[rows] = ORIGIN[0] + pos * BLOCK_LAT
+            lon[rows] = ORIGIN[1] + idx * BLOCK_LON
+        else:
+            pos = across[rows]
+            lat[rows] = ORIGIN[0] + idx * BLOCK_LAT
+            lon[rows] = ORIGIN[1] + pos * BLOCK_LON
+        # 100 house numbers per block, even/odd sides
+        numbers = (100 + pos * 100).astype(int) // 2 * 2 + rng.integers(0, 2, len(rows))
+        addresses[rows] = [f'{h} {name} {suffix}' for h in numbers]
+    # Intersections snap to a grid corner
+    cross = np.nonzero(rng.random(n) < intersection_share)[0]
+    ai = rng.integers(0, len(AVENUES), len(cross))
+    si = rng.integers(0, len(STREETS), len(cross))
+    lat[cross] = ORIGIN[0] + si * BLOCK_LAT
+    lon[cross] = ORIGIN[1] + ai * BLOCK_LON
+    bare = rng.random(len(cross)) < 0.5  # "CEDAR & WARREN" vs "WARREN AVE & E CEDAR ST"
+    addresses[cross] = [
+        f'{STREETS[s].split()[-1]} & {AVENUES[a]}' if b else f'{AVENUES[a]} AVE & {STREETS[s]} ST'
+        for a, s, b in zip(ai, si, bare)
+    ]
+    return addresses, lat, lon
+
+
+def _decorate(addresses, rng):
+    """Raw-export noise: descriptors, units, spelled-out suffixes, mixed case."""
+    out = addresses.copy()
+    n = len(out)
+    roll = rng.random(n)
+    desc = rng.integers(0, len(DESCRIPTORS), n)
+    for i in np.nonzero(roll < 0.08)[0]:
+        out[i] = f'{out[i]}; {DESCRIPTORS[desc[i]]}'
+    for i in np.nonzero((roll >= 0.08) & (roll < 0.10))[0]:
+        if '&' not in out[i]:
+            out[i] = f'{out[i]} #{desc[i] + 1}'
+    for i in np.nonzero((roll >= 0.10) & (roll < 0.13))[0]:
+        head, _, suffix = out[i].rpartition(' ')
+        if suffix in SPELLED:
+            out[i] = f'{head} {SPELLED[suffix]}'
+    for i in np.nonzero((roll >= 0.13) & (roll < 0.15))[0]:
+        out[i] = out[i].title()
+    return out
+
+
+def _timestamps(n, rng, years=YEARS):
+    start = pd.Timestamp(f'{years[0]}-01-01').value // 10**9
+    end = pd.Timestamp(f'{years[1]}-06-30 23:59:59').value // 10**9
+    # Busier afternoons: mix a uniform draw with an afternoon-centered one
+    seconds = rng.integers(start, end, n)
+    day = seconds - seconds % 86400
+    tod = np.where(rng.random(n) < 0.6, rng.normal(15 * 3600, 4 * 3600, n), rng.uniform(0, 86400, n))
+    return pd.to_datetime(day + np.clip(tod, 0, 86399).astype(np.int64), unit='s')
+
+
+def _format_timestamps(ts, rng, mixed_share):
+    fmt_pick = np.where(rng.random(len(ts)) < mixed_share,
+                        rng.integers(0, len(DATE_FORMATS), len(ts)), -1)
+    # REAL_FORMAT by slicing the ISO text; strftime is ~20x slower
+    iso = ts.astype(str)
+    raw = pd.Series([f'{t[11:19]} {t[5:7]}/{t[8:10]}/{t[2:4]}' for t in iso], dtype=object)
+    for k, (fmt, _) in enumerate(DATE_FORMATS):
+        rows = np.nonzero(fmt_pick == k)[0]
+        if len(rows):
+            raw.iloc[rows] = ts[rows].strftime(fmt)
+    return raw
+
+
+def raw_frame(rows, seed=0, agencies=1, intersection_share=0.1, mixed_share=0.1, rules_path=DEFAULT_RULES):
+    """Raw export rows (HEADER columns, all strings) plus their ground truth.
+
+    Returns (raw, truth) where truth holds each row's undecorated
+    address, lat/lon and timestamp; use it to seed a geocode cache or
+    stub geocoder.
+    """
+    rng = np.random.default_rng(seed)
+    codes = nature_codes(rules_path, rng)
+    nature = np.asarray(codes, dtype=object)[rng.choice(len(codes), rows, p=_zipf_weights(len(codes)))]
+    ts = _timestamps(rows, rng)
+    addresses, lat, lon = _locations(rows, rng, intersection_share)
+    agency_idx = rng.integers(0, agencies, rows)
+    agency = np.array(['PPD'] + [f'AG{k}' for k in range(1, agencies)], dtype=object)[agency_idx]
+    area = np.array([f'PD{k}' for k in range(1, 10)], dtype=object)[(agency_idx + 7) % 9]
+    order = np.argsort(ts.values, kind='stable')
+    years = ts.year.to_numpy()[order] % 100
+    seq = pd.Series(years).groupby(years).cumcount().to_numpy() + 1
+    raw = pd.DataFrame({
+        'Incident': [f'{y:02d}-P{s:05d}' for y, s in zip(years, seq)],
+        'Nature': nature[order],
+        'Area': area[order],
+        'Agency': agency[order],
+        'Reported': _format_timestamps(ts[order], rng, mixed_share).to_numpy(),
+        'Incident address': _decorate(addresses[order], rng),
+    })
+    truth = pd.DataFrame({'address': addresses[order], 'lat': lat[order], 'lon': lon[order],
+                          'reported_dt': ts[order]})
+    return raw, truth
+
+
+def write_workbooks(raw, out_dir, max_rows=EXCEL_MAX_ROWS - 1):
+    """Write raw as one workbook per year, split at Excel's row limit."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    year = 2000 + raw['Incident'].str[:2].astype(int)
+    paths = []
+    for y, part in raw.groupby(year, sort=True):
+        for k, start in enumerate(range(0, len(part), max_rows)):
+            path = out_dir / (f'{y}.xlsx' if k == 0 else f'{y}_part{k + 1}.xlsx')
+            wb = Workbook(write_only=True)
+            ws = wb.create_sheet('Records')
+            ws.append(HEADER)
+            for row in part.iloc[start:start + max_rows].itertuples(index=False, name=None):
+                ws.append(row)
+            wb.save(path)
+            paths.append(path)
+            logging.info(f'Wrote {path} ({min(max_rows, len(part) - start):,} rows)')
+    return paths
+
+
+def clean_frame(rows, seed=0, agencies=1, intersection_share=0.1, rules_path=DEFAULT_RULES):
+    """Cleaned, geocoded incidents shaped like the build's frame after geocoding.
+
+    Skips the raw-text round trip: addresses are the undecorated ones
+    and reported_dt_raw is ISO text (one of DATE_FORMATS).
+    """
+    raw, truth = raw_frame(rows, seed, agencies, intersection_share, mixed_share=0.0, rules_path=rules_path)
+    df = pd.DataFrame({
+        'incident_id': raw['Incident'],
+        'nature': raw['Nature'],
+        'area': raw['Area'],
+        'agency': raw['Agency'],
+        'reported_dt_raw': truth['reported_dt'].astype(str),
+        'address': canonicalize_series(truth['address']),
+        'reported_dt': truth['reported_dt'],
+    })
+    df = add_date_parts(df)
+    df['nature_grp'] = recode_nature(df['nature'], rules_path)
+    df = encode_addresses(df)
+    # One geocode per address, as the real join gives: the address's mean
+    # true location plus ~10 m geocoder noise
+    rng = np.random.default_rng(seed + 1)
+    codes = df['address_id'].to_numpy()
+    n = len(df['address'].cat.categories)
+    counts = np.bincount(codes, minlength=n)
+    lat = np.bincount(codes, truth['lat'].to_numpy(), n) / counts + rng.normal(0, 0.0001, n)
+    lon = np.bincount(codes, truth['lon'].to_numpy(), n) / counts + rng.normal(0, 0.0001, n)
+    df['lat'] = lat[codes]
+    df['lon'] = lon[codes]
+    return df
+
+
+def geocodes(raw, truth):
+    """Canonical address -> (lat, lon) for every address in raw."""
+    table = pd.DataFrame({'address': canonicalize_series(raw['Incident address']),
+                          'lat': truth['lat'].to_numpy(), 'lon': truth['lon'].to_numpy()})
+    table = table.groupby('address')[['lat', 'lon']].mean()
+    return {a: (lat, lon) for a, lat, lon in table.itertuples(name=None)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write synthetic raw incident workbooks.')
+    parser.add_argument('out_dir', type=Path)
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--agencies', type=int, default=1)
+    parser.add_argument('--mixed-share', type=float, default=0.1,
+                        help='Share of timestamps written in a non-default DATE_FORMAT.')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+    raw, _ = raw_frame(args.rows, args.seed, args.agencies, mixed_share=args.mixed_share)
+    write_workbooks(raw, args.out_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,29 +2,77 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 from streamlit_folium import folium_static
-import folium
-from folium.plugins import HeatMap, MarkerCluster, Fullscreen
 from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+from cube import CUBE_PATH, build_cube, read_cube, slice_cube
+from maps import cached_map_html, location_summary
+from query import IncidentIndex
+from spatial import BINS_PATH, HotspotIndex
+from store import read_incidents, store_mtime
+from summary import SUMMARY_PATH, load_summary, table
 
 st.set_page_config(page_title="Alameda Police Dashboard", layout="wide")
 
 st.title("Alameda Police Incidents Dashboard")
 
-DATA_PATH = Path('data/clean_incidents.csv')
+MAP_CACHE_DIR = Path('maps/.cache')
+DAY_NAMES = ['Monday','Tuesday','Wednesday','Thursday','Friday','Saturday','Sunday']
+
+def data_version():
+    """Changes whenever the cube, the spatial bins, the summary or the incident store is rebuilt."""
+    cube_mtime = CUBE_PATH.stat().st_mtime if CUBE_PATH.exists() else 0.0
+    bins_mtime = BINS_PATH.stat().st_mtime if BINS_PATH.exists() else 0.0
+    summary_mtime = SUMMARY_PATH.stat().st_mtime if SUMMARY_PATH.exists() else 0.0
+    return cube_mtime, bins_mtime, summary_mtime, store_mtime()
+
+@st.cache_data
+def load_cube(version):
+    if CUBE_PATH.exists():
+        return read_cube(CUBE_PATH)
+    return build_cube(read_incidents())
+
+@st.cache_data
+def cube_slice(version, by, groups):
+    return slice_cube(load_cube(version), by, groups)
+
+@st.cache_resource
+def incident_index(version):
+    """Row-level incidents with time, bitmap and grid indexes for filtered lookups."""
+    return IncidentIndex.from_store()
+
+@st.cache_data
+def load_hotspots(version):
+    if BINS_PATH.exists():
+        return HotspotIndex.load(BINS_PATH)
+    return HotspotIndex.from_frame(read_incidents(columns=['nature_grp', 'year', 'month', 'lat', 'lon']))
+
+@st.cache_data
+def report_summary(version):
+    return load_summary(SUMMARY_PATH)
 
-def load_data():
-    df = pd.read_csv(DATA_PATH)
-    if 'reported_dt' in df.columns:
-        df['reported_dt'] = pd.to_datetime(df['reported_dt'], errors='coerce')
-        if 'dayofweek' not in df.columns:
-            df['dayofweek'] = df['reported_dt'].dt.day_name()
-        if 'month' not in df.columns:
-            df['month'] = df['reported_dt'].dt.month
-        if 'hour' not in df.columns:
-            df['hour'] = df['reported_dt'].dt.hour
-    return df
+version = data_version()
+cube = load_cube(version)
+summary = report_summary(version)
+all_types = sorted(cube['nature_grp'].dropna().unique())
 
-df = load_data()
+# --- Headline numbers (from the build's report summary) ---
+by_year = summary['by_year']
+if summary['last_incident'] and pd.Timestamp(summary['last_incident']).month < 12:
+    by_year = by_year[:-1]  # the latest year is partial
+col1, col2, col3 = st.columns(3)
+col1.metric('Incidents', f"{summary['incidents']:,}")
+if summary['years']:
+    col2.metric('Years Covered', f"{summary['years'][0]}–{summary['years'][1]}")
+if by_year:
+    latest = by_year[-1]
+    delta = f"{latest['pct_change']:+.1f}% vs {latest['year'] - 1}" if latest['pct_change'] is not None else None
+    col3.metric(f"Incidents in {latest['year']}", f"{latest['incidents']:,}", delta=delta, delta_color='inverse')
+
+def type_filter(key):
+    """Incident type multiselect; returns a hashable selection for cached slices."""
+    return tuple(st.multiselect('Incident Types to Include', all_types, default=all_types, key=key))
 
 # --- Tab Setup ---
 chart_tabs = [
@@ -37,64 +85,51 @@ chart_tabs = [
     "Incident Type Pie",
     "Nature Group Bar",
     "Seasonality Heatmap",
-    "Incident Location Scatter"
+    "Incident Location Scatter",
+    "Hotspots"
 ]
 tabs = st.tabs(chart_tabs)
 
 # --- Tab 1: Interactive Map ---
+@st.cache_data
+def map_html(version, groups):
+    """Map page for one type selection; also cached on disk per selection."""
+    located = incident_index(version).query(located=True, nature_grp=groups,
+                                            columns=('reported_dt', 'nature_grp', 'address', 'lat', 'lon'))
+    return cached_map_html(located, MAP_CACHE_DIR, label_col='nature_grp', groups=groups)
+
+@st.cache_data
+def map_locations(version, groups, n=50):
+    """The n busiest map locations for one type selection, busiest first."""
+    located = incident_index(version).query(located=True, nature_grp=groups,
+                                            columns=('reported_dt', 'nature_grp', 'address', 'lat', 'lon'))
+    summary = location_summary(located, label_col='nature_grp')
+    return summary.sort_values('incidents', ascending=False, kind='stable').head(n).reset_index(drop=True)
+
 with tabs[0]:
     st.markdown('### Hotspot Map')
-    all_types = sorted(df['nature_grp'].dropna().unique())
-    type_selection = st.multiselect('Incident Types to Show', all_types, default=all_types)
-    filtered_df = df[df['nature_grp'].isin(type_selection)]
-    if filtered_df.empty:
+    type_selection = tuple(st.multiselect('Incident Types to Show', all_types, default=all_types))
+    if not type_selection:
         st.warning('No data for selected types.')
     else:
-        map_df = filtered_df.dropna(subset=['lat','lon'])
-        m = folium.Map(location=[map_df['lat'].median(), map_df['lon'].median()], zoom_start=13)
-        Fullscreen().add_to(m)
-        if not map_df.empty:
-            # Heatmap layer
-            hm = HeatMap(
-                data=map_df[['lat','lon']].values,
-                radius=10, blur=7, min_opacity=0.4, max_zoom=1,
-                name='Heatmap'
-            )
-            hm.add_to(m)
-
-            # MarkerCluster layer with interactive popups
-            marker_cluster = MarkerCluster(name='Incidents').add_to(m)
-            for _, row in map_df.iterrows():
-                popup = folium.Popup(f"<b>Date:</b> {row['reported_dt']}<br><b>Type:</b> {row['nature_grp']}<br><b>Address:</b> {row['address']}", max_width=300)
-                folium.Marker(
-                    location=[row['lat'], row['lon']],
-                    popup=popup,
-                    tooltip=f"{row['nature_grp']}<br>{row['reported_dt']}"
-                ).add_to(marker_cluster)
-
-            # Optional: Add a summary circle marker layer for counts per location
-            loc_counts = map_df.groupby(['lat','lon']).size().reset_index(name='count')
-            for _, row in loc_counts.iterrows():
-                if row['count'] > 1:
-                    folium.CircleMarker(
-                        location=[row['lat'], row['lon']],
-                        radius=6 + row['count']**0.5,
-                        color='blue', fill=True, fill_opacity=0.3,
-                        popup=folium.Popup(f"{row['count']} incidents at this location", max_width=200),
-                        tooltip=f"{row['count']} incidents"
-                    ).add_to(m)
-        folium.LayerControl().add_to(m)
         import streamlit.components.v1 as components
-        folium_map_html = m.get_root().render()
-        components.html(folium_map_html, width=1200, height=700)
+        components.html(map_html(version, type_selection), width=1200, height=700)
+        st.markdown('#### Drill Down')
+        locations = map_locations(version, type_selection)
+        pick = st.selectbox('Location', locations.index, key='map_drill_location',
+                            format_func=lambda i: f"{locations.at[i, 'address']} ({locations.at[i, 'incidents']:,} incidents)")
+        if pick is not None:
+            lat, lon = locations.at[pick, 'lat'], locations.at[pick, 'lon']
+            incidents = incident_index(version).query(bbox=(lon, lon, lat, lat), nature_grp=type_selection,
+                                                      columns=('reported_dt', 'nature', 'nature_grp', 'address', 'incident_id'))
+            st.dataframe(incidents, hide_index=True)
+            st.download_button('Download Data', data=incidents.to_csv(index=False), file_name='location_incidents.csv', mime='text/csv', key='download_map_drill')
 
 # --- Tab 2: Yearly Trend ---
 with tabs[1]:
     st.markdown('### Yearly Trend (Incidents per Year)')
-    chart_types = sorted(df['nature_grp'].dropna().unique())
-    chart_type_sel = st.multiselect('Incident Types to Include', chart_types, default=chart_types, key='yearly_trend_types')
-    filtered = df[df['nature_grp'].isin(chart_type_sel)]
-    yearly = filtered.groupby('year').size().reset_index(name='incidents')
+    chart_type_sel = type_filter('yearly_trend_types')
+    yearly = cube_slice(version, ('year',), chart_type_sel)
     fig = px.line(yearly, x='year', y='incidents', markers=True, title='Incidents per Year')
     st.plotly_chart(fig, use_container_width=True, key="yearly_trend")
     st.download_button('Download Data', data=yearly.to_csv(index=False), file_name='yearly_trend.csv', mime='text/csv', key='download_yearly_trend')
@@ -102,62 +137,46 @@ with tabs[1]:
 # --- Tab 3: Monthly Trend ---
 with tabs[2]:
     st.markdown('### Monthly Trend (Average Incidents per Month, All Full Years)')
-    chart_types = sorted(df['nature_grp'].dropna().unique())
-    chart_type_sel = st.multiselect('Incident Types to Include', chart_types, default=chart_types, key='monthly_trend_types')
-    filtered = df[df['nature_grp'].isin(chart_type_sel)]
-    if 'month' in filtered.columns and 'year' in filtered.columns:
-        df_complete = filtered[filtered['year'] < 2025]  # drop the partial year
-        monthly_avg = df_complete.groupby(['year','month']).size().groupby('month').mean().reset_index(name='avg_incidents')
-        fig_avg = px.bar(monthly_avg, x='month', y='avg_incidents', title='Average Incidents per Month (Excludes Partial 2025)')
-        st.plotly_chart(fig_avg, use_container_width=True, key="monthly_avg_trend")
-        st.download_button('Download Data', data=monthly_avg.to_csv(index=False), file_name='monthly_avg_trend.csv', mime='text/csv', key='download_monthly_avg_trend')
-        st.caption('This chart shows the average number of incidents per month, excluding partial 2025 data.')
-        st.markdown('---')
-        st.markdown('#### Raw Monthly Totals (All Data)')
-        monthly = filtered.groupby('month').size().reset_index(name='incidents')
-        fig_raw = px.bar(monthly, x='month', y='incidents', title='Raw Incident Totals per Month')
-        st.plotly_chart(fig_raw, use_container_width=True, key="monthly_trend_raw")
-        st.download_button('Download Data', data=monthly.to_csv(index=False), file_name='monthly_trend_raw.csv', mime='text/csv', key='download_monthly_trend_raw')
-        st.caption('Counts reflect 6 months of January–March data but only 5 months of October–December; 2025 data are partial.')
-    else:
-        st.info('No month data available.')
+    chart_type_sel = type_filter('monthly_trend_types')
+    year_month = cube_slice(version, ('year', 'month'), chart_type_sel)
+    df_complete = year_month[year_month['year'] < 2025]  # drop the partial year
+    monthly_avg = df_complete.groupby('month')['incidents'].mean().reset_index(name='avg_incidents')
+    fig_avg = px.bar(monthly_avg, x='month', y='avg_incidents', title='Average Incidents per Month (Excludes Partial 2025)')
+    st.plotly_chart(fig_avg, use_container_width=True, key="monthly_avg_trend")
+    st.download_button('Download Data', data=monthly_avg.to_csv(index=False), file_name='monthly_avg_trend.csv', mime='text/csv', key='download_monthly_avg_trend')
+    st.caption('This chart shows the average number of incidents per month, excluding partial 2025 data.')
+    st.markdown('---')
+    st.markdown('#### Raw Monthly Totals (All Data)')
+    monthly = cube_slice(version, ('month',), chart_type_sel)
+    fig_raw = px.bar(monthly, x='month', y='incidents', title='Raw Incident Totals per Month')
+    st.plotly_chart(fig_raw, use_container_width=True, key="monthly_trend_raw")
+    st.download_button('Download Data', data=monthly.to_csv(index=False), file_name='monthly_trend_raw.csv', mime='text/csv', key='download_monthly_trend_raw')
+    st.caption('Counts reflect 6 months of January–March data but only 5 months of October–December; 2025 data are partial.')
 
 # --- Tab 4: Day of Week ---
 with tabs[3]:
     st.markdown('### Day of Week Trend')
-    chart_types = sorted(df['nature_grp'].dropna().unique())
-    chart_type_sel = st.multiselect('Incident Types to Include', chart_types, default=chart_types, key='dow_trend_types')
-    filtered = df[df['nature_grp'].isin(chart_type_sel)]
-    if 'dayofweek' in filtered.columns:
-        dow = filtered.groupby('dayofweek').size().reset_index(name='incidents')
-        fig = px.bar(dow, x='dayofweek', y='incidents', title='Incidents by Day of Week', category_orders={'dayofweek': ['Monday','Tuesday','Wednesday','Thursday','Friday','Saturday','Sunday']})
-        st.plotly_chart(fig, use_container_width=True, key="dow_trend")
-        st.download_button('Download Data', data=dow.to_csv(index=False), file_name='dayofweek_trend.csv', mime='text/csv', key='download_dow_trend')
-    else:
-        st.info('No day of week data available.')
+    chart_type_sel = type_filter('dow_trend_types')
+    dow = cube_slice(version, ('dow',), chart_type_sel)
+    dow = pd.DataFrame({'dayofweek': [DAY_NAMES[d] for d in dow['dow']], 'incidents': dow['incidents']})
+    fig = px.bar(dow, x='dayofweek', y='incidents', title='Incidents by Day of Week', category_orders={'dayofweek': DAY_NAMES})
+    st.plotly_chart(fig, use_container_width=True, key="dow_trend")
+    st.download_button('Download Data', data=dow.to_csv(index=False), file_name='dayofweek_trend.csv', mime='text/csv', key='download_dow_trend')
 
 # --- Tab 5: Hour of Day ---
 with tabs[4]:
     st.markdown('### Hour of Day Trend')
-    chart_types = sorted(df['nature_grp'].dropna().unique())
-    chart_type_sel = st.multiselect('Incident Types to Include', chart_types, default=chart_types, key='hour_trend_types')
-    filtered = df[df['nature_grp'].isin(chart_type_sel)]
-    if 'hour' in filtered.columns:
-        hour = filtered.groupby('hour').size().reset_index(name='incidents')
-        fig = px.bar(hour, x='hour', y='incidents', title='Incidents by Hour of Day')
-        st.plotly_chart(fig, use_container_width=True, key="hour_trend")
-        st.download_button('Download Data', data=hour.to_csv(index=False), file_name='hour_trend.csv', mime='text/csv', key='download_hour_trend')
-    else:
-        st.info('No hour data available.')
+    chart_type_sel = type_filter('hour_trend_types')
+    hour = cube_slice(version, ('hour',), chart_type_sel)
+    fig = px.bar(hour, x='hour', y='incidents', title='Incidents by Hour of Day')
+    st.plotly_chart(fig, use_container_width=True, key="hour_trend")
+    st.download_button('Download Data', data=hour.to_csv(index=False), file_name='hour_trend.csv', mime='text/csv', key='download_hour_trend')
 
 # --- Tab 6: Incident Type Bar ---
 with tabs[5]:
     st.markdown('### Incident Type Distribution (Bar)')
-    chart_types = sorted(df['nature_grp'].dropna().unique())
-    chart_type_sel = st.multiselect('Incident Types to Include', chart_types, default=chart_types, key='type_bar_types')
-    filtered = df[df['nature_grp'].isin(chart_type_sel)]
-    type_dist = filtered['nature'].value_counts().reset_index()
-    type_dist.columns = ['nature', 'incidents']
+    chart_type_sel = type_filter('type_bar_types')
+    type_dist = cube_slice(version, ('nature',), chart_type_sel).sort_values('incidents', ascending=False)
     fig = px.bar(type_dist, x='nature', y='incidents', title='Incident Type Distribution (Bar)')
     st.plotly_chart(fig, use_container_width=True, key="type_dist_bar")
     st.download_button('Download Data', data=type_dist.to_csv(index=False), file_name='type_dist_bar.csv', mime='text/csv', key='download_type_dist_bar')
@@ -165,11 +184,8 @@ with tabs[5]:
 # --- Tab 7: Incident Type Pie ---
 with tabs[6]:
     st.markdown('### Incident Type Distribution (Pie)')
-    chart_types = sorted(df['nature_grp'].dropna().unique())
-    chart_type_sel = st.multiselect('Incident Types to Include', chart_types, default=chart_types, key='type_pie_types')
-    filtered = df[df['nature_grp'].isin(chart_type_sel)]
-    type_dist = filtered['nature'].value_counts().reset_index()
-    type_dist.columns = ['nature', 'incidents']
+    chart_type_sel = type_filter('type_pie_types')
+    type_dist = cube_slice(version, ('nature',), chart_type_sel).sort_values('incidents', ascending=False)
     fig = px.pie(type_dist, names='nature', values='incidents', title='Incident Type Distribution (Pie)')
     st.plotly_chart(fig, use_container_width=True, key="type_dist_pie")
     st.download_button('Download Data', data=type_dist.to_csv(index=False), file_name='type_dist_pie.csv', mime='text/csv', key='download_type_dist_pie')
@@ -177,26 +193,25 @@ with tabs[6]:
 # --- Tab 8: Nature Group Bar ---
 with tabs[7]:
     st.markdown('### Nature Group Distribution (Bar)')
-    chart_types = sorted(df['nature_grp'].dropna().unique())
-    chart_type_sel = st.multiselect('Incident Types to Include', chart_types, default=chart_types, key='nature_grp_bar_types')
-    filtered = df[df['nature_grp'].isin(chart_type_sel)]
-    if 'nature_grp' in filtered.columns:
-        grp = filtered['nature_grp'].value_counts().reset_index()
-        grp.columns = ['nature_grp', 'incidents']
-        fig = px.bar(grp, x='nature_grp', y='incidents', title='Nature Group Distribution (Bar)')
-        st.plotly_chart(fig, use_container_width=True, key="nature_grp_bar")
-        st.download_button('Download Data', data=grp.to_csv(index=False), file_name='nature_grp_bar.csv', mime='text/csv', key='download_nature_grp_bar')
-    else:
-        st.info('No nature group data available.')
+    chart_type_sel = type_filter('nature_grp_bar_types')
+    grp = cube_slice(version, ('nature_grp',), chart_type_sel).sort_values('incidents', ascending=False)
+    fig = px.bar(grp, x='nature_grp', y='incidents', title='Nature Group Distribution (Bar)')
+    st.plotly_chart(fig, use_container_width=True, key="nature_grp_bar")
+    st.download_button('Download Data', data=grp.to_csv(index=False), file_name='nature_grp_bar.csv', mime='text/csv', key='download_nature_grp_bar')
+    st.markdown('#### Year-over-Year Change by Group')
+    yoy = table(summary, 'by_group_year')
+    yoy = yoy[yoy['nature_grp'].isin(chart_type_sel)]
+    st.dataframe(yoy, hide_index=True)
+    st.download_button('Download Data', data=yoy.to_csv(index=False), file_name='nature_grp_yoy.csv', mime='text/csv', key='download_nature_grp_yoy')
 
 # --- Tab 9: Seasonality Heatmap ---
 with tabs[8]:
     st.markdown('### Seasonality Heatmap (Hour x Month)')
-    chart_types = sorted(df['nature_grp'].dropna().unique())
-    chart_type_sel = st.multiselect('Incident Types to Include', chart_types, default=chart_types, key='seasonality_heatmap_types')
-    filtered = df[df['nature_grp'].isin(chart_type_sel)]
-    if 'hour' in filtered.columns and 'month' in filtered.columns:
-        heatmap_data = filtered.groupby(['month','hour']).size().reset_index(name='incidents')
+    chart_type_sel = type_filter('seasonality_heatmap_types')
+    heatmap_data = cube_slice(version, ('month', 'hour'), chart_type_sel)
+    if heatmap_data.empty:
+        st.info('No hour or month data available for heatmap.')
+    else:
         heatmap_pivot = heatmap_data.pivot(index='hour', columns='month', values='incidents').fillna(0)
         import plotly.figure_factory as ff
         z = heatmap_pivot.values
@@ -206,19 +221,48 @@ with tabs[8]:
         fig.update_layout(title_text='Seasonality Heatmap (Hour x Month)', xaxis_title='Month', yaxis_title='Hour of Day')
         st.plotly_chart(fig, use_container_width=True, key="seasonality_heatmap")
         st.download_button('Download Data', data=heatmap_data.to_csv(index=False), file_name='seasonality_heatmap.csv', mime='text/csv', key='download_seasonality_heatmap')
-    else:
-        st.info('No hour or month data available for heatmap.')
 
 # --- Tab 10: Incident Location Scatter ---
 with tabs[9]:
     st.markdown('### Incident Locations (Scatter Map)')
-    chart_types = sorted(df['nature_grp'].dropna().unique())
-    chart_type_sel = st.multiselect('Incident Types to Include', chart_types, default=chart_types, key='location_scatter_types')
-    filtered = df[df['nature_grp'].isin(chart_type_sel)]
-    if 'lat' in filtered.columns and 'lon' in filtered.columns:
-        fig = px.scatter_mapbox(filtered.dropna(subset=['lat','lon']), lat='lat', lon='lon', hover_data=['reported_dt','nature','address'],
-                               title='Incident Locations', zoom=11, height=600)
-        fig.update_layout(mapbox_style="open-street-map")
-        st.plotly_chart(fig, use_container_width=True, key="location_scatter")
+    chart_type_sel = type_filter('location_scatter_types')
+    index = incident_index(version)
+    if not len(index):
+        st.info('No location data available.')
     else:
+        first, last = index.times[0].astype('datetime64[D]').item(), index.times[-1].astype('datetime64[D]').item()
+        dates = st.date_input('Date Range', value=(first, last), min_value=first, max_value=last, key='location_scatter_dates')
+        start, end = (dates[0], dates[-1]) if dates else (first, last)
+        filtered = index.query(start, pd.Timestamp(end) + pd.Timedelta(days=1), located=True, nature_grp=chart_type_sel,
+                               columns=('reported_dt', 'nature', 'nature_grp', 'address', 'lat', 'lon'))
+        fig = px.scatter_map(filtered, lat='lat', lon='lon', hover_data=['reported_dt','nature','address'],
+                             title='Incident Locations', zoom=11, height=600)
+        fig.update_layout(map_style="open-street-map")
+        st.plotly_chart(fig, use_container_width=True, key="location_scatter")
+        st.download_button('Download Data', data=filtered.to_csv(index=False), file_name='incident_locations.csv', mime='text/csv', key='download_location_scatter')
+
+# --- Tab 11: Hotspots ---
+with tabs[10]:
+    st.markdown('### Hotspots (Kernel Density Peaks)')
+    chart_type_sel = type_filter('hotspot_types')
+    hotspots = load_hotspots(version)
+    years = sorted(int(y) for y in hotspots.bins['year'].unique())
+    if not years or not chart_type_sel:
         st.info('No location data available.')
+    else:
+        start, end = st.select_slider('Years', options=years, value=(years[0], years[-1]), key='hotspot_years')
+        peaks = hotspots.top(15, groups=chart_type_sel, start=start, end=end)
+        fig = px.scatter_map(peaks, lat='lat', lon='lon', size='density', hover_data=['incidents'],
+                             title=f'Top Hotspots {start}-{end}', zoom=12, height=600)
+        fig.update_layout(map_style="open-street-map")
+        st.plotly_chart(fig, use_container_width=True, key="hotspot_peaks")
+        st.dataframe(peaks)
+        st.download_button('Download Data', data=peaks.to_csv(index=False), file_name='hotspots.csv', mime='text/csv', key='download_hotspots')
+        st.markdown('---')
+        st.markdown('#### Change Between Years')
+        col1, col2 = st.columns(2)
+        before = col1.selectbox('Before', years, index=0, key='hotspot_before')
+        after = col2.selectbox('After', years, index=len(years) - 1, key='hotspot_after')
+        changes = hotspots.change((before, before), (after, after), groups=chart_type_sel)
+        st.dataframe(changes)
+        st.download_button('Download Data', data=changes.to_csv(index=False), file_name='hotspot_change.csv', mime='text/csv', key='download_hotspot_change')
@@ -1,20 +1,26 @@
-import pandas as pd
+import sys
 
-df = pd.read_csv('data/clean_incidents.csv')
-print('Total incidents:', len(df))
-if 'year' in df.columns:
-    print('Years:', df['year'].min(), 'to', df['year'].max())
-if 'reported_dt' in df.columns:
-    print('First incident date:', df["reported_dt"].min())
+sys.path.insert(0, 'src')
+from summary import load_summary, table
+
+summary = load_summary()
+print('Total incidents:', summary['incidents'])
+if summary['years']:
+    print('Years:', summary['years'][0], 'to', summary['years'][1])
+if summary['first_incident']:
+    print('First incident date:', summary['first_incident'])
 print('\nIncidents per year:')
-if 'year' in df.columns:
-    print(df.groupby('year').size().to_string())
+if summary['by_year']:
+    print(table(summary, 'by_year').to_string(index=False))
 print('\nIncident type breakdown:')
-if 'nature_grp' in df.columns:
-    print(df['nature_grp'].value_counts().to_string())
+if summary['by_group']:
+    print(table(summary, 'by_group').to_string(index=False))
+print('\nYear-over-year change by incident type:')
+if summary['by_group_year']:
+    print(table(summary, 'by_group_year').to_string(index=False))
 print('\nIncidents by area:')
-if 'area' in df.columns:
-    print(df['area'].value_counts().to_string())
+if summary['by_area']:
+    print(table(summary, 'by_area').to_string(index=False))
 print('\nMost common address:')
-if 'address' in df.columns:
-    print(df['address'].value_counts().idxmax())
+if summary['top_addresses']:
+    print(summary['top_addresses'][0]['address'])
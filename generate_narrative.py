@@ -1,36 +1,45 @@
-import pandas as pd
+import sys
 
-df = pd.read_csv('data/clean_incidents.csv')
+sys.path.insert(0, 'src')
+from summary import load_summary
+
+summary = load_summary()
 with open('data_narrative.md', 'w') as f:
     f.write('# Police Incident Data Narrative Summary\n\n')
-    f.write(f'This summary is based on {len(df):,} police incident records for Pocatello, ID.\n\n')
+    f.write(f'This summary is based on {summary["incidents"]:,} police incident records for Pocatello, ID.\n\n')
     # Time span
-    if 'year' in df.columns:
+    if summary['years']:
         f.write('## Time Span\n')
-        f.write(f'- Years covered: {df["year"].min()} to {df["year"].max()}\n')
+        f.write(f'- Years covered: {summary["years"][0]} to {summary["years"][1]}\n')
         f.write('\n')
-    if 'reported_dt' in df.columns:
-        f.write(f'- First incident: {df["reported_dt"].min()}\n')
+    if summary['first_incident']:
+        f.write(f'- First incident: {summary["first_incident"]}\n')
         f.write('\n')
     # Overall trends
-    if 'year' in df.columns:
+    if summary['by_year']:
         f.write('## Overall Trends\n')
-        by_year = df.groupby('year').size()
         f.write('- Incidents per year:\n')
-        for y, n in by_year.items():
-            f.write(f'    - {y}: {n:,}\n')
+        for row in summary['by_year']:
+            change = f' ({row["pct_change"]:+.1f}% vs {row["year"] - 1})' if row['pct_change'] is not None else ''
+            f.write(f'    - {row["year"]}: {row["incidents"]:,}{change}\n')
         f.write('\n')
-    if 'nature_grp' in df.columns:
+    if summary['by_group']:
         f.write('## Incident Type Breakdown\n')
-        for grp, n in df["nature_grp"].value_counts().items():
-            f.write(f'- {grp}: {n:,} incidents\n')
+        for row in summary['by_group']:
+            f.write(f'- {row["nature_grp"]}: {row["incidents"]:,} incidents\n')
+        f.write('\n')
+    if summary['by_group_year']:
+        f.write('## Year-over-Year Change by Incident Type\n')
+        for row in summary['by_group_year']:
+            if row['change'] is not None:
+                f.write(f'- {row["nature_grp"]} {row["year"]}: {row["incidents"]:,} '
+                        f'({row["change"]:+,}, {row["pct_change"]:+.1f}%)\n')
         f.write('\n')
-    if 'area' in df.columns:
+    if summary['by_area']:
         f.write('## Incidents by Area\n')
-        for area, n in df["area"].value_counts().items():
-            f.write(f'- {area}: {n:,} incidents\n')
+        for row in summary['by_area']:
+            f.write(f'- {row["area"]}: {row["incidents"]:,} incidents\n')
         f.write('\n')
-    if 'address' in df.columns:
-        top_addr = df["address"].value_counts().idxmax()
+    if summary['top_addresses']:
         f.write('## Most Common Address\n')
-        f.write(f'- {top_addr}\n')
+        f.write(f'- {summary["top_addresses"][0]["address"]}\n')
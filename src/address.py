@@ -0,0 +1,88 @@
+"""
+Address canonicalization for Alameda Police Data ETL.
+
+Raw incident addresses arrive as free text ("310 E OAK ST; REEL THEATRE",
+"WEST CENTER STREET", "Wayne Ave & E Walnut St"). canonicalize() reduces
+them to one spelling so the geocode cache, the resolver and the final
+join all see the same key. The city/state/zip is not repeated per row;
+geocode_query() adds LOCALITY when talking to a geocoder.
+"""
+
+import re
+import pandas as pd
+
+LOCALITY = 'Pocatello, ID 83201'
+
+DIRECTIONALS = {
+    'NORTH': 'N', 'SOUTH': 'S', 'EAST': 'E', 'WEST': 'W',
+    'NORTHEAST': 'NE', 'NORTHWEST': 'NW', 'SOUTHEAST': 'SE', 'SOUTHWEST': 'SW',
+}
+DIRECTIONAL_ABBREVS = set(DIRECTIONALS.values())
+SUFFIXES = {
+    'STREET': 'ST', 'STR': 'ST', 'AVENUE': 'AVE', 'AV': 'AVE', 'DRIVE': 'DR', 'ROAD': 'RD',
+    'BOULEVARD': 'BLVD', 'PLACE': 'PL', 'COURT': 'CT', 'LANE': 'LN', 'CIRCLE': 'CIR',
+    'TERRACE': 'TER', 'HIGHWAY': 'HWY', 'PARKWAY': 'PKWY',
+}
+SUFFIX_ABBREVS = set(SUFFIXES.values()) | {'WAY'}
+# A unit keyword needs a space or a digit after it, so STEWART and LOTUS stay street names
+UNIT_RE = re.compile(r'\s+(#\s*\S+|(APT|UNIT|STE|SUITE|LOT|SPC|TRLR)\.?(\s+\S+|\d\S*)|\d+/\d+)$')
+INTERSECTION_RE = re.compile(r'\s*&\s*|\s+AND\s+')
+LOCALITY_RE = re.compile(r',\s*POCATELLO\b.*$')
+
+
+def canonical_street(street):
+    """Canonical form of one street-level address (no locality, no descriptor)."""
+    street = ' '.join(street.upper().replace('.', ' ').replace(',', ' ').split())
+    while True:
+        trimmed = UNIT_RE.sub('', street)
+        if trimmed == street:
+            break
+        street = trimmed
+    tokens = street.split()
+    if not tokens:
+        return ''
+    # Directional sits first, or right after the house number; it is only
+    # a directional if a street name follows ("123 WEST ST" is West Street)
+    pos = 1 if tokens[0].isdigit() and len(tokens) > 2 else 0
+    named = any(t not in SUFFIXES and t not in SUFFIX_ABBREVS for t in tokens[pos + 1:])
+    if named and tokens[pos] in DIRECTIONALS:
+        tokens[pos] = DIRECTIONALS[tokens[pos]]
+    if len(tokens) > 1 and tokens[-1] in SUFFIXES:
+        tokens[-1] = SUFFIXES[tokens[-1]]
+    return ' '.join(tokens)
+
+
+def canonicalize(addr):
+    """Canonical address key.
+
+    Drops the ';' business descriptor, any trailing Pocatello locality and
+    unit designators; abbreviates directionals and street suffixes; and
+    orders the two sides of an intersection alphabetically.
+    """
+    if addr is None or (isinstance(addr, float) and pd.isna(addr)):
+        return ''
+    street = LOCALITY_RE.sub('', str(addr).split(';')[0].upper())
+    parts = [canonical_street(p) for p in INTERSECTION_RE.split(street)]
+    parts = [p for p in parts if p]
+    if len(parts) == 2:
+        return ' & '.join(sorted(parts))
+    return canonical_street(street)
+
+
+def canonicalize_series(addresses):
+    """Canonicalize a series, doing the work once per distinct value."""
+    uniq = pd.unique(addresses)
+    mapping = {a: canonicalize(a) for a in uniq}
+    return addresses.map(mapping)
+
+
+def geocode_query(addr, locality=LOCALITY):
+    """Full query string for a canonical address."""
+    return f'{addr}, {locality}' if locality else addr
+
+
+def encode_addresses(df):
+    """Dictionary-encode df['address'] and add its integer address_id."""
+    df['address'] = df['address'].astype('category')
+    df['address_id'] = df['address'].cat.codes.astype('int32')
+    return df
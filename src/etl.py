@@ -14,27 +14,143 @@ from pathlib import Path
 from datetime import datetime
 import re
 import logging
+import hashlib
+import inspect
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from openpyxl import load_workbook as open_xlsx
+import address
+from address import canonicalize_series, encode_addresses
+from nature import DEFAULT_RULES, recode_nature
+from metrics import METRICS, capture, count, measure
 
-def load_and_clean_xlsx(raw_dir):
-    """Load and clean all Excel files from raw_dir."""
-    files = list(Path(raw_dir).glob('20*.xlsx'))
-    dfs = []
-    for f in files:
-        df = pd.read_excel(f, dtype=str)
-        logging.info(f"Loaded {f.name} with columns: {list(df.columns)}")
-        dfs.append(df)
-    df = pd.concat(dfs, ignore_index=True)
-    logging.info(f"After concatenation: {len(df)} rows\nSample:\n{df.head()}")
+# Map normalized columns to expected names
+COL_MAP = {
+    'incident_id': 'incident',
+    'nature': 'nature',
+    'area': 'area',
+    'agency': 'agency',
+    'reported_dt_raw': 'reported',
+    'address': 'incident_address'
+}
+# Accepted timestamp formats, in precedence order, with the pattern that
+# detects each one so a whole format group can be parsed in one batch.
+DATE_FORMATS = (
+    ('%Y-%m-%d %H:%M:%S', r'\d{4}-\d{1,2}-\d{1,2} \d{1,2}:\d{1,2}:\d{1,2}'),
+    ('%m/%d/%Y %H:%M', r'\d{1,2}/\d{1,2}/\d{4} \d{1,2}:\d{1,2}'),
+    ('%m/%d/%Y %H:%M:%S', r'\d{1,2}/\d{1,2}/\d{4} \d{1,2}:\d{1,2}:\d{1,2}'),
+    ('%Y-%m-%dT%H:%M:%S', r'\d{4}-\d{1,2}-\d{1,2}T\d{1,2}:\d{1,2}:\d{1,2}'),
+    ('%H:%M:%S %m/%d/%y', r'\d{1,2}:\d{1,2}:\d{1,2} \d{1,2}/\d{1,2}/\d{2}'),
+)
+# Strings pd.read_excel treats as missing by default
+NA_VALUES = frozenset({
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+})
+MANIFEST_NAME = 'etl_manifest.json'
+PARTITION_DIR = 'partitions'
+PARALLEL_MIN_BYTES = 8 << 20  # below this much xlsx, starting worker processes costs more than it saves
+
+
+def _cell_str(val):
+    """Convert an openpyxl cell value the way pd.read_excel(dtype=str) would."""
+    if val is None:
+        return np.nan
+    if isinstance(val, float) and val.is_integer():
+        val = int(val)
+    val = str(val)
+    return np.nan if val in NA_VALUES else val
+
+
+def iter_workbook(path, chunk_rows=None):
+    """Stream the col_map columns of one raw Excel export as string frames.
+
+    The sheet is opened read-only and only the six needed columns are
+    materialised, so wide exports cost no more than narrow ones. With
+    chunk_rows, frames of at most that many rows are yielded as the sheet
+    is read; otherwise the whole sheet comes back as one frame.
+    """
+    wb = open_xlsx(path, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = [str(c).lower().strip().replace(' ', '_') if c is not None else '' for c in next(rows, ())]
+        logging.info(f"Loaded {Path(path).name} with columns: {header}")
+        missing = [v for v in COL_MAP.values() if v not in header]
+        if missing:
+            raise ValueError(f"Required columns missing: {missing}. Available columns: {header}")
+        idx = [header.index(v) for v in COL_MAP.values()]
+        data = []
+        yielded = False
+        for row in rows:
+            vals = [row[i] if i < len(row) else None for i in idx]
+            if all(v is None for v in vals):
+                continue
+            data.append([_cell_str(v) for v in vals])
+            if chunk_rows and len(data) >= chunk_rows:
+                yield pd.DataFrame(data, columns=list(COL_MAP.values()), dtype=str)
+                data, yielded = [], True
+        if data or not yielded:
+            yield pd.DataFrame(data, columns=list(COL_MAP.values()), dtype=str)
+    finally:
+        wb.close()
+
+
+def read_workbook(path):
+    """Read the col_map columns of one raw Excel export as strings."""
+    return list(iter_workbook(path))[0]
+
+
+def parse_reported_dt(raw):
+    """Parse raw timestamp strings one format group at a time.
+
+    Returns the parsed series (NaT where nothing matched) and a dict of
+    rows parsed per format plus an 'unparseable' count.
+    """
+    pending = raw
+    pieces = []
+    counts = {}
+    for fmt, pattern in DATE_FORMATS:
+        if pending.empty:
+            counts[fmt] = 0
+            continue
+        match = pending[pending.str.fullmatch(pattern).fillna(False).astype(bool)]
+        parsed = pd.to_datetime(match, format=fmt, errors='coerce').dropna()
+        counts[fmt] = len(parsed)
+        pieces.append(parsed)
+        pending = pending.drop(parsed.index)
+    counts['unparseable'] = len(pending)
+    pieces = [p for p in pieces if len(p)]
+    if pieces:
+        parsed = pd.concat(pieces).reindex(raw.index)
+    else:
+        parsed = pd.Series(pd.NaT, index=raw.index, dtype='datetime64[ns]')
+    return parsed, counts
+
+
+def add_date_parts(df):
+    """Derive year/month/day/hour/dow from reported_dt."""
+    dt = df['reported_dt'].dt
+    df['year'] = dt.year
+    df['month'] = dt.month
+    df['day'] = dt.day
+    df['hour'] = dt.hour
+    df['dow'] = dt.dayofweek
+    return df
+
+
+def _log_sample(message, frame):
+    """Log message; the frame sample is only formatted when DEBUG is on."""
+    logging.info(message)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f"Sample:\n{frame.head()}")
+
+
+def clean_frame(df):
+    """Apply the cleaning rules to one raw frame."""
     # Standardize columns
-    # Map normalized columns to expected names
-    col_map = {
-        'incident_id': 'incident',
-        'nature': 'nature',
-        'area': 'area',
-        'agency': 'agency',
-        'reported_dt_raw': 'reported',
-        'address': 'incident_address'
-    }
+    col_map = COL_MAP
     colnames = [c.lower().strip().replace(' ', '_') for c in df.columns]
     df.columns = colnames
     missing = [v for v in col_map.values() if v not in df.columns]
@@ -45,51 +161,173 @@ def load_and_clean_xlsx(raw_dir):
     # Rename columns to match expected names
     df = df.rename(columns={v: k for k, v in col_map.items()})
     df = df[list(col_map.keys())]
-    logging.info(f"After renaming/selecting columns: {len(df)} rows\nSample:\n{df.head()}")
+    _log_sample(f"After renaming/selecting columns: {len(df)} rows", df)
     # Clean and parse dates
     df['reported_dt_raw'] = df['reported_dt_raw'].astype(str).str.strip()
-    def parse_dt(val):
-        for fmt in ('%Y-%m-%d %H:%M:%S', '%m/%d/%Y %H:%M', '%m/%d/%Y %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%H:%M:%S %m/%d/%y'):
-            try:
-                return datetime.strptime(val, fmt)
-            except Exception:
-                continue
-        return pd.NaT
-    df['reported_dt'] = df['reported_dt_raw'].apply(parse_dt)
-    logging.info(f"After parsing dates: {len(df)} rows\nSample:\n{df[['reported_dt_raw','reported_dt']].head()}")
+    with measure('etl.parse_dates', rows_in=len(df)) as step:
+        df['reported_dt'], counts = parse_reported_dt(df['reported_dt_raw'])
+        step['rows_out'] = len(df) - counts.get('unparseable', 0)
+    logging.info(f"Parsed timestamps per format: {counts}")
+    _log_sample(f"After parsing dates: {len(df)} rows", df[['reported_dt_raw','reported_dt']])
     # Drop rows with bad dates or empty address
     before_drop = len(df)
     df = df[~df['reported_dt'].isna()]
     df = df[df['address'].notnull() & (df['address'].astype(str).str.strip() != '')]
-    logging.info(f"After dropping bad dates/empty addresses: {len(df)} rows (dropped {before_drop - len(df)})\nSample:\n{df.head()}")
-    # Strip business/descriptor after semicolon for geocoding
-    df['address'] = df['address'].astype(str).str.split(';').str[0].str.strip()
-    # Add city/state/zip context for geocoding
-    df['address'] = df['address'] + ', Pocatello, ID 83201'
-    logging.info(f"After cleaning and appending city/state/zip: Sample addresses:\n{df['address'].head()}")
+    _log_sample(f"After dropping bad dates/empty addresses: {len(df)} rows (dropped {before_drop - len(df)})", df)
+    # Canonicalize addresses (descriptor, directionals, suffixes, units);
+    # city/state/zip is added only when querying a geocoder
+    df['address'] = canonicalize_series(df['address'].astype(str))
+    df = df[df['address'] != '']
+    _log_sample(f"After canonicalizing addresses: {len(df)} rows", df['address'])
     # Derived date parts
-    df['year'] = df['reported_dt'].dt.year
-    df['month'] = df['reported_dt'].dt.month
-    df['day'] = df['reported_dt'].dt.day
-    df['hour'] = df['reported_dt'].dt.hour
-    df['dow'] = df['reported_dt'].dt.dayofweek
+    df = add_date_parts(df)
     # Clean nature
     df['nature'] = df['nature'].astype(str).str.strip().str.upper()
     # Drop junk rows
     df = df[df['nature'] != '']
+    return df
+
+
+def load_workbook(path):
+    """Read and clean one raw Excel export."""
+    name = Path(path).name
+    with measure(f'etl.read_workbook[{name}]') as step:
+        raw = read_workbook(path)
+        step['rows_out'] = len(raw)
+    with measure(f'etl.clean_frame[{name}]', rows_in=len(raw)) as step:
+        df = clean_frame(raw)
+        step['rows_out'] = len(df)
+    return df
+
+
+def rules_fingerprint():
+    """Hash of everything that shapes a cleaned partition.
+
+    Any edit to the reading or cleaning code (date formats, column map,
+    address canonicalization) changes this hash and invalidates every
+    cached partition. Nature groups are assigned after the partitions are
+    assembled, so editing nature_groups.md does not invalidate them.
+    """
+    h = hashlib.sha256()
+    for obj in (_cell_str, iter_workbook, read_workbook, parse_reported_dt, add_date_parts, clean_frame, load_workbook, address):
+        h.update(inspect.getsource(obj).encode())
+    h.update(repr((COL_MAP, DATE_FORMATS, sorted(NA_VALUES))).encode())
+    return h.hexdigest()
+
+
+def file_fingerprint(path, previous=None):
+    """Content hash of a raw workbook, reusing previous when size/mtime match."""
+    stat = Path(path).stat()
+    if previous and previous.get('size') == stat.st_size and previous.get('mtime_ns') == stat.st_mtime_ns:
+        return previous
+    h = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            h.update(block)
+    return {'sha256': h.hexdigest(), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def load_manifest(cache_dir):
+    """Load the partition manifest, or an empty one."""
+    path = Path(cache_dir) / MANIFEST_NAME
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {'rules': None, 'files': {}}
+
+
+def save_manifest(cache_dir, manifest):
+    path = Path(cache_dir) / MANIFEST_NAME
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'w') as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    tmp.replace(path)
+
+
+def load_workbooks(files, workers=1):
+    """Read and clean files, in order, on up to workers processes.
+
+    Small batches (under PARALLEL_MIN_BYTES in total) are parsed serially.
+    """
+    files = list(files)
+    workers = min(workers or 1, len(files))
+    if workers > 1 and sum(Path(f).stat().st_size for f in files) < PARALLEL_MIN_BYTES:
+        workers = 1
+    if workers <= 1:
+        return [load_workbook(f) for f in files]
+    logging.info(f'Parsing {len(files)} workbooks on {workers} worker processes')
+    # forkserver, as in vis.build_charts: the pipeline may run stages on threads
+    context = multiprocessing.get_context('forkserver')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        results = list(pool.map(partial(capture, load_workbook), files))
+    for _, snap in results:
+        METRICS.merge(snap)
+    return [df for df, _ in results]
+
+
+def load_and_clean_xlsx(raw_dir, cache_dir=None, force=False, workers=1, nature_rules=DEFAULT_RULES):
+    """Load and clean all Excel files from raw_dir.
+
+    With cache_dir, each workbook's cleaned rows are persisted as a partition
+    and only new or changed workbooks are re-parsed. force=True rebuilds all.
+    workers > 1 parses workbooks in parallel; the result is identical to the
+    serial path. nature_grp is assigned from nature_rules after assembly.
+    """
+    files = sorted(Path(raw_dir).glob('20*.xlsx'))
+    if cache_dir is None:
+        dfs = load_workbooks(files, workers)
+    else:
+        dfs = _load_partitions(files, Path(cache_dir), force, workers)
+    df = pd.concat(dfs, ignore_index=True)
+    _log_sample(f"After concatenation: {len(df)} rows", df)
     # Recode nature
-    def recode_nature(val):
-        if any(x in val for x in ['THEFT','BURGLARY','LARCENY','SHOPLIFT','ROBBERY']):
-            return 'PROPERTY'
-        if any(x in val for x in ['ASSAULT','BATTERY','WEAPON','DOMESTIC','SEX']):
-            return 'VIOLENT'
-        if any(x in val for x in ['DISTURBANCE','DISORDERLY','HARASS','NOISE']):
-            return 'DISORDER'
-        if any(x in val for x in ['DUI','CRASH','TRAFFIC','ABANDONED VEHIC']):
-            return 'TRAFFIC'
-        if any(x in val for x in ['WELFARE CHECK','MENTAL','SUICIDE','MISSING']):
-            return 'SERVICE'
-        return 'OTHER'
-    df['nature_grp'] = df['nature'].apply(recode_nature)
+    with measure('etl.recode_nature', rows_in=len(df)):
+        df['nature_grp'] = recode_nature(df['nature'], nature_rules)
     df = df.reset_index(drop=True)
+    # One compact integer id per distinct address
+    df = encode_addresses(df)
     return df
+
+
+def _load_partitions(files, cache_dir, force, workers=1):
+    """Return cleaned frames for files, re-parsing only stale partitions."""
+    part_dir = cache_dir / PARTITION_DIR
+    part_dir.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(cache_dir)
+    rules = rules_fingerprint()
+    if manifest.get('rules') != rules:
+        if manifest.get('rules') is not None:
+            logging.info('Cleaning rules changed; invalidating all cached partitions.')
+        force = True
+    old_files = manifest.get('files', {})
+    new_files = {}
+    frames = {}
+    stale = []
+    for f in files:
+        prev = old_files.get(f.name)
+        fp = file_fingerprint(f, prev)
+        part = part_dir / f'{f.stem}.pkl'
+        new_files[f.name] = dict(fp, partition=part.name)
+        if not force and prev and prev.get('sha256') == fp['sha256'] and part.exists():
+            frames[f.name] = pd.read_pickle(part)
+            logging.info(f'Reused cached partition for {f.name} ({len(frames[f.name])} rows)')
+            count('etl.partitions_reused')
+        else:
+            stale.append(f)
+    for f, df in zip(stale, load_workbooks(stale, workers)):
+        df.to_pickle(part_dir / new_files[f.name]['partition'])
+        frames[f.name] = df
+        logging.info(f'Re-parsed {f.name} ({len(df)} rows)')
+        count('etl.partitions_parsed')
+    dfs = []
+    for f in files:
+        new_files[f.name]['rows'] = len(frames[f.name])
+        dfs.append(frames[f.name])
+    # Drop partitions whose source workbook is gone
+    for name, entry in old_files.items():
+        if name not in new_files and entry.get('partition'):
+            (part_dir / entry['partition']).unlink(missing_ok=True)
+            logging.info(f'Removed partition for deleted workbook {name}')
+    save_manifest(cache_dir, {'rules': rules, 'files': new_files})
+    return dfs
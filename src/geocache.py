@@ -0,0 +1,180 @@
+"""
+Geocode cache store for Alameda Police Data ETL.
+
+Results live in an SQLite table keyed by canonical address (see
+address.canonicalize). Every geocoder answer
+is written (and committed) as it arrives. Misses are negative-cached
+until their retry_after time, and each row records which backend and
+query produced it. The legacy geocode_cache.csv format can be imported
+and exported.
+
+    python src/geocache.py import cache/geocode_cache.csv
+    python src/geocache.py export cache/geocode_cache.csv
+"""
+
+import sqlite3
+import sys
+import time
+import logging
+from pathlib import Path
+import pandas as pd
+from address import canonicalize
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS geocodes (
+    address     TEXT PRIMARY KEY,
+    lat         REAL,
+    lon         REAL,
+    status      TEXT NOT NULL,  -- 'hit' or 'miss'
+    backend     TEXT,
+    query       TEXT,
+    fallback    INTEGER NOT NULL DEFAULT 0,
+    updated     REAL NOT NULL,
+    retry_after REAL
+)
+"""
+DEFAULT_PATH = Path('cache/geocode_cache.sqlite')
+MISS_TTL = 30 * 24 * 3600  # seconds before a failed address is retried
+LOOKUP_COLUMNS = ['lat', 'lon', 'status', 'backend', 'query', 'fallback', 'retry_after']
+SCHEMA_VERSION = 1  # 1: keys are canonical addresses without locality
+
+
+class GeocodeCache:
+    """Indexed, append-as-you-go geocode cache."""
+
+    def __init__(self, path=DEFAULT_PATH, miss_ttl=MISS_TTL):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.miss_ttl = miss_ttl
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+        self._migrate()
+
+    def _migrate(self):
+        """Re-key rows written before addresses were canonicalized."""
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        rows = self.conn.execute(
+            "SELECT * FROM geocodes ORDER BY status = 'hit', updated"
+        ).fetchall()
+        with self.conn:
+            self.conn.execute('DELETE FROM geocodes')
+            # Later rows win, so a hit beats a miss for the same canonical key
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                ((canonicalize(r[0]),) + tuple(r[1:]) for r in rows if canonicalize(r[0])),
+            )
+            self.conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        if rows:
+            logging.info(f'Migrated {len(rows)} geocode cache rows to canonical addresses')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM geocodes').fetchone()[0]
+
+    def get(self, address):
+        """Return the cached row for address as a dict, or None."""
+        cur = self.conn.execute(f'SELECT {", ".join(LOOKUP_COLUMNS)} FROM geocodes WHERE address = ?', (address,))
+        row = cur.fetchone()
+        return dict(zip(LOOKUP_COLUMNS, row)) if row else None
+
+    def lookup(self, addresses):
+        """Batch lookup; returns a frame indexed by address for the cached ones."""
+        addresses = pd.unique(pd.Series(list(addresses), dtype=object))
+        self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS wanted (address TEXT PRIMARY KEY)')
+        self.conn.execute('DELETE FROM wanted')
+        self.conn.executemany('INSERT OR IGNORE INTO wanted VALUES (?)', ((a,) for a in addresses))
+        cols = ', '.join(f'g.{c}' for c in LOOKUP_COLUMNS)
+        rows = self.conn.execute(f'SELECT g.address, {cols} FROM wanted w JOIN geocodes g USING (address)').fetchall()
+        self.conn.execute('DELETE FROM wanted')
+        return pd.DataFrame(rows, columns=['address'] + LOOKUP_COLUMNS).set_index('address')
+
+    def hits(self, exclude_backends=()):
+        """All successful geocodes as an address, lat, lon frame."""
+        sql = "SELECT address, lat, lon FROM geocodes WHERE status = 'hit'"
+        if exclude_backends:
+            sql += f" AND COALESCE(backend, '') NOT IN ({', '.join('?' * len(exclude_backends))})"
+        return pd.read_sql_query(sql, self.conn, params=tuple(exclude_backends))
+
+    def pending(self, addresses, now=None):
+        """Addresses with no hit and no unexpired negative-cache entry."""
+        now = time.time() if now is None else now
+        found = self.lookup(addresses)
+        fresh = (found['status'] == 'hit') | (found['retry_after'].fillna(0) > now)
+        done = set(found.index[fresh])
+        return [a for a in pd.unique(pd.Series(list(addresses), dtype=object)) if a not in done]
+
+    def due(self, now=None):
+        """(address, updated) of every miss whose retry_after has passed, by address."""
+        now = time.time() if now is None else now
+        return self.conn.execute("SELECT address, updated FROM geocodes WHERE status = 'miss' "
+                                 'AND COALESCE(retry_after, 0) <= ? ORDER BY address', (now,)).fetchall()
+
+    def put(self, address, lat=None, lon=None, backend=None, query=None, fallback=False, now=None, ttl=None):
+        """Record one geocoder answer; lat=None records a miss, retried after ttl (default miss_ttl)."""
+        now = time.time() if now is None else now
+        ttl = self.miss_ttl if ttl is None else ttl
+        hit = lat is not None and lon is not None and not (pd.isna(lat) or pd.isna(lon))
+        self.conn.execute(
+            'INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (address, lat if hit else None, lon if hit else None, 'hit' if hit else 'miss',
+             backend, query, int(bool(fallback)), now, None if hit else now + ttl),
+        )
+        self.conn.commit()
+
+    def import_csv(self, csv_path, backend='import'):
+        """Load rows from the legacy address,lat,lon CSV. Misses become retryable at once."""
+        df = pd.read_csv(csv_path, dtype={'address': str, 'lat': float, 'lon': float})
+        df['query'] = df['address']
+        df['address'] = df['address'].map(canonicalize)
+        df['hit'] = df['lat'].notnull() & df['lon'].notnull()
+        # Several raw spellings may share a canonical key; keep a hit if any
+        df = df[df['address'] != ''].sort_values('hit', kind='stable').drop_duplicates('address', keep='last')
+        now = time.time()
+        rows = [
+            (a, la if h else None, lo if h else None, 'hit' if h else 'miss', backend, q, 0, now, None if h else now)
+            for a, la, lo, h, q in zip(df['address'], df['lat'], df['lon'], df['hit'], df['query'])
+        ]
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        logging.info(f'Imported {len(rows)} cached geocodes from {csv_path}')
+        return len(rows)
+
+    def export_csv(self, csv_path):
+        """Write the cache in the legacy address,lat,lon CSV format (canonical keys)."""
+        df = pd.read_sql_query('SELECT address, lat, lon FROM geocodes ORDER BY updated, address', self.conn)
+        df.to_csv(csv_path, index=False)
+        logging.info(f'Exported {len(df)} cached geocodes to {csv_path}')
+        return len(df)
+
+
+def open_cache(path=DEFAULT_PATH, legacy_csv=None):
+    """Open the cache, seeding it from legacy_csv the first time."""
+    fresh = not Path(path).exists()
+    cache = GeocodeCache(path)
+    if fresh and legacy_csv and Path(legacy_csv).exists():
+        cache.import_csv(legacy_csv)
+    return cache
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    if len(sys.argv) != 3 or sys.argv[1] not in ('import', 'export'):
+        sys.exit(f'usage: {sys.argv[0]} import|export CSV_PATH')
+    with GeocodeCache() as store:
+        if sys.argv[1] == 'import':
+            store.import_csv(sys.argv[2])
+        else:
+            store.export_csv(sys.argv[2])
@@ -3,78 +3,284 @@ Geocoding helper for Alameda Police Data ETL.
 """
 
 import pandas as pd
+import numpy as np
+import math
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from geopy.geocoders import Nominatim
 from geopy.exc import GeocoderTimedOut, GeocoderServiceError
 import logging
+from address import LOCALITY, encode_addresses, geocode_query
+from geocache import GeocodeCache
+from metrics import count, measure, observe
+from resolver import LocalResolver
 
+STREET_TYPES = ["St", "Ave", "Dr", "Rd", "Blvd", "Pl", "Ct", "Ln", "Way", "Cir", "Ter"]
+LOCAL_CONFIDENCE = 0.8  # offline answers at or above this skip the network
+INTERSECTIONS_CSV = 'cache/intersection_addresses.csv'
 
-def geocode_addresses(df, cache_path):
-    """Geocode unique addresses in df, using cache_path for results."""
-    # Load cache
+
+class TokenBucket:
+    """Thread-safe token bucket shared by every request of a run."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        if math.isinf(self.rate):
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Reserve a token now and sleep off any deficit outside the lock
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class NominatimBackend:
+    """Public OpenStreetMap Nominatim, limited to 1 request/second by policy."""
+    name = 'nominatim'
+    rate = 1.0
+
+    def __init__(self, user_agent='poky-police-data', domain='nominatim.openstreetmap.org', scheme='https', timeout=10):
+        self.geolocator = Nominatim(user_agent=user_agent, domain=domain, scheme=scheme)
+        self.timeout = timeout
+
+    def geocode(self, query):
+        """Return (lat, lon) for query, or None if nothing matched."""
+        location = self.geolocator.geocode(query, timeout=self.timeout)
+        if not location:
+            return None
+        return location.latitude, location.longitude
+
+
+class SelfHostedBackend(NominatimBackend):
+    """Our own Nominatim-compatible endpoint; no public usage limits apply."""
+    name = 'selfhosted'
+    rate = 20.0
+
+    def __init__(self, url=None, scheme=None, **kwargs):
+        if not url:
+            raise ValueError('The selfhosted geocoder needs the URL of its endpoint')
+        if '://' in url:
+            scheme, url = url.split('://', 1)
+        super().__init__(domain=url.rstrip('/'), scheme=scheme or 'http', **kwargs)
+
+
+class StubBackend:
+    """Offline backend answering from a dict; for tests and benchmarks."""
+    name = 'stub'
+    rate = math.inf
+
+    def __init__(self, results=None, default=None):
+        self.results = results or {}
+        self.default = default
+
+    def geocode(self, query):
+        return self.results.get(query, self.default)
+
+
+BACKENDS = {
+    NominatimBackend.name: NominatimBackend,
+    SelfHostedBackend.name: SelfHostedBackend,
+    StubBackend.name: StubBackend,
+}
+
+
+def make_backend(name='nominatim', **kwargs):
+    """Instantiate a geocoding backend by name."""
     try:
-        cache = pd.read_csv(cache_path, dtype={'address': str, 'lat': float, 'lon': float})
-    except Exception:
-        cache = pd.DataFrame(columns=['address', 'lat', 'lon'])
-    cache = cache.drop_duplicates('address').set_index('address')
-    geolocator = Nominatim(user_agent='poky-police-data')
-    addresses = df['address'].unique()
-    new_rows = []
-    STREET_TYPES = ["St", "Ave", "Dr", "Rd", "Blvd", "Pl", "Ct", "Ln", "Way", "Cir", "Ter"]
-    intersection_addresses = []
-    for addr in addresses:
-        if addr in cache.index and pd.notnull(cache.loc[addr, 'lat']) and pd.notnull(cache.loc[addr, 'lon']):
-            continue
-        if '&' in addr:
-            intersection_addresses.append(addr)
-            logging.info(f'Skipping intersection address: {addr}')
-            continue
-        orig_addr = addr
-        tried_fallback = False
+        return BACKENDS[name](**kwargs)
+    except KeyError:
+        raise ValueError(f'Unknown geocoder backend {name!r}; choose from {sorted(BACKENDS)}')
+
+
+class GeocodeEngine:
+    """Geocode addresses concurrently under a shared rate limit.
+
+    Addresses are canonical street-level keys; locality is appended to
+    every query sent to the backend.
+    """
+
+    def __init__(self, backend, workers=4, rate=None, retries=3, backoff=2.0, locality=LOCALITY):
+        self.backend = backend
+        self.locality = locality
+        self.workers = max(1, workers)
+        self.limiter = TokenBucket(rate or backend.rate)
+        self.retries = retries
+        self.backoff = backoff
+
+    def query(self, query):
+        """Send one rate-limited query, retrying transient errors with backoff.
+
+        Returns (lat, lon) or None; raises the last error once retries run out.
+        """
+        for attempt in range(self.retries + 1):
+            waited = time.perf_counter()
+            self.limiter.acquire()
+            started = time.perf_counter()
+            observe('geocode.rate_wait_s', started - waited)
+            count('geocode.requests')
+            try:
+                return self.backend.geocode(query)
+            except (GeocoderTimedOut, GeocoderServiceError) as e:
+                count('geocode.request_errors')
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                logging.warning(f'Geocode error for {query} ({e}); retrying in {delay:.0f}s')
+            finally:
+                observe('geocode.request_s', time.perf_counter() - started)
+            time.sleep(delay)
+
+    def geocode_one(self, addr, candidates=None):
+        """Geocode one address, trying alternative queries if it misses.
+
+        candidates are street-level alternatives known to be plausible
+        (e.g. the street's real suffix); without them every street type
+        is tried.
+        """
+        query = geocode_query(addr, self.locality)
+        result = {'address': addr, 'lat': None, 'lon': None, 'query': query, 'fallback': False, 'error': None}
         # 1. Try as-is
         try:
-            location = geolocator.geocode(addr, timeout=10)
+            location = self.query(query)
         except (GeocoderTimedOut, GeocoderServiceError) as e:
-            location = None
-            logging.warning(f'Geocode failed for {addr}: {e}')
-        # 2. If fail and not intersection, try appending street types
+            result['error'] = str(e)
+            return result
+        # 2. If fail, try appending street types
         if not location:
-            tried_fallback = True
-            # Only try if address before first comma is missing a street type
-            street_part = addr.split(',')[0].strip()
-            if not any(street_part.upper().endswith(f" {stype.upper()}") for stype in STREET_TYPES):
-                base = ','.join(addr.split(',')[1:]).strip()
-                for stype in STREET_TYPES:
-                    mod_addr = f"{street_part} {stype}, {base}"
-                    try:
-                        location = geolocator.geocode(mod_addr, timeout=10)
-                        if location:
-                            logging.info(f'Geocoded (added type): {mod_addr} -> ({location.latitude:.5f}, {location.longitude:.5f})')
-                            break
-                    except Exception:
-                        continue
-        # 3. Save result (success or fail)
+            # Only try if the address is missing a street type
+            if candidates is None and not any(addr.upper().endswith(f" {stype.upper()}") for stype in STREET_TYPES):
+                candidates = [f"{addr} {stype}" for stype in STREET_TYPES]
+            for alt in candidates or []:
+                mod_query = geocode_query(alt, self.locality)
+                try:
+                    location = self.query(mod_query)
+                except (GeocoderTimedOut, GeocoderServiceError):
+                    continue
+                if location:
+                    result.update(query=mod_query, fallback=True)
+                    break
         if location:
-            lat, lon = location.latitude, location.longitude
-            new_rows.append({'address': orig_addr, 'lat': lat, 'lon': lon})
-            if tried_fallback:
-                logging.info(f'Geocoded (with fallback): {orig_addr} -> ({lat:.5f}, {lon:.5f})')
-            else:
-                logging.info(f'Geocoded: {orig_addr} -> ({lat:.5f}, {lon:.5f})')
+            result['lat'], result['lon'] = location
+        return result
+
+    def geocode_batch(self, addresses, on_result=None, candidates=None):
+        """Geocode addresses on the worker pool.
+
+        on_result is called from the calling thread as each result arrives,
+        so callers can checkpoint without extra locking. candidates maps an
+        address to its alternative queries (see geocode_one).
+        """
+        candidates = candidates or {}
+        results = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(self.geocode_one, addr, candidates.get(addr)) for addr in addresses]
+            for fut in as_completed(futures):
+                result = fut.result()
+                if on_result:
+                    on_result(result)
+                results.append(result)
+        return results
+
+
+def _log_result(result):
+    addr, lat, lon = result['address'], result['lat'], result['lon']
+    if result['error']:
+        logging.warning(f"Geocode failed for {addr}: {result['error']}")
+    elif lat is None:
+        logging.warning(f'No geocode result: {addr}')
+    elif result['fallback']:
+        logging.info(f"Geocoded (with fallback {result['query']}): {addr} -> ({lat:.5f}, {lon:.5f})")
+    else:
+        logging.info(f'Geocoded: {addr} -> ({lat:.5f}, {lon:.5f})')
+
+
+def write_intersections(addresses, path=INTERSECTIONS_CSV):
+    """Save skipped intersection addresses for manual review."""
+    if addresses:
+        pd.DataFrame({'address': addresses}).to_csv(path, index=False)
+        logging.info(f'Saved {len(addresses)} intersection addresses to {path} for manual review.')
+
+
+def geocode_addresses(df, cache, engine=None, resolver=None, min_confidence=LOCAL_CONFIDENCE, intersections=None):
+    """Geocode unique addresses in df, using the GeocodeCache cache.
+
+    cache may also be a path to the SQLite store. Work is done once per
+    distinct address: df['address'] is dictionary-encoded and lat/lon are
+    joined back through address_id. Misses are first tried against the
+    offline LocalResolver (built from the cache by default); only answers
+    below min_confidence go to the network. Each result is committed as
+    soon as it arrives, so an interrupted run resumes where it stopped.
+    Skipped intersection addresses are written to INTERSECTIONS_CSV, or
+    appended to the intersections list when one is passed (for callers
+    that geocode in several batches and write the file once).
+    """
+    if not isinstance(cache, GeocodeCache):
+        with GeocodeCache(cache) as store:
+            return geocode_addresses(df, store, engine, resolver, min_confidence, intersections)
+    if engine is None:
+        engine = GeocodeEngine(make_backend())
+    if 'address_id' not in df.columns or not isinstance(df['address'].dtype, pd.CategoricalDtype):
+        df = encode_addresses(df.copy())
+    addresses = list(df['address'].cat.categories)
+    with measure('geocode.cache_lookup', rows_in=len(addresses)) as step:
+        pending = cache.pending(addresses)
+        step['rows_out'] = len(pending)
+    count('geocode.cache_hits', len(addresses) - len(pending))
+    count('geocode.cache_misses', len(pending))
+    logging.info(f'Geocode cache: {len(addresses) - len(pending)} of {len(addresses)} addresses resolved')
+    if pending and resolver is None:
+        resolver = LocalResolver.from_cache(cache)
+    todo = []
+    candidates = {}
+    intersection_addresses = []
+    for addr in pending:
+        local = resolver.resolve(addr)
+        if local and local['confidence'] >= min_confidence:
+            cache.put(addr, local['lat'], local['lon'], backend='local', query=local['query'])
+            count('geocode.resolved_locally')
+            logging.info(f"Resolved locally ({local['confidence']:.2f}): {addr} -> ({local['lat']:.5f}, {local['lon']:.5f})")
+        elif '&' in addr:
+            intersection_addresses.append(addr)
+            count('geocode.skipped_intersections')
+            logging.info(f'Skipping intersection address: {addr}')
         else:
-            new_rows.append({'address': orig_addr, 'lat': None, 'lon': None})
-            logging.warning(f'No geocode result: {orig_addr}')
-        time.sleep(1)  # Be nice to Nominatim
-    # Save skipped intersection addresses for manual review
-    if intersection_addresses:
-        pd.DataFrame({'address': intersection_addresses}).to_csv('cache/intersection_addresses.csv', index=False)
-        logging.info(f'Saved {len(intersection_addresses)} intersection addresses to cache/intersection_addresses.csv for manual review.')
-    if new_rows:
-        new_cache = pd.DataFrame(new_rows).set_index('address')
-        cache = pd.concat([cache, new_cache])
-        cache = cache[~cache.index.duplicated(keep='last')]
-        cache.reset_index().to_csv(cache_path, index=False)
-    # Merge geocodes into main df
-    cache = cache.reset_index()
-    df = df.merge(cache, on='address', how='left')
-    return df
+            todo.append(addr)
+            suggestions = resolver.suggest(addr)
+            if suggestions:
+                candidates[addr] = suggestions
+    if todo:
+        logging.info(f'Geocoding {len(todo)} uncached addresses with {engine.backend.name} ({engine.workers} workers)')
+
+        def checkpoint(result):
+            _log_result(result)
+            count('geocode.network_found' if result['lat'] is not None else 'geocode.network_missed')
+            # Errors are transient: record a miss that is due again on the next run
+            cache.put(result['address'], result['lat'], result['lon'], backend=engine.backend.name,
+                      query=result['query'], fallback=result['fallback'], ttl=0 if result['error'] else None)
+
+        with measure('geocode.network', rows_in=len(todo)):
+            engine.geocode_batch(todo, on_result=checkpoint, candidates=candidates)
+    if intersections is None:
+        write_intersections(intersection_addresses)
+    else:
+        intersections.extend(intersection_addresses)
+    # Join geocodes back by address_id
+    found = cache.lookup(addresses).reindex(addresses)
+    codes = df['address_id'].to_numpy()
+    # Code -1 (no address) would index the last address; append a NaN slot for it
+    lat = np.append(found['lat'].to_numpy(dtype=float), np.nan)
+    lon = np.append(found['lon'].to_numpy(dtype=float), np.nan)
+    codes = np.where(codes < 0, len(lat) - 1, codes)
+    return df.assign(lat=lat[codes], lon=lon[codes])
@@ -3,11 +3,37 @@ Main orchestrator for Alameda Police Data ETL, geocoding, and analytics build.
 """
 
 from pathlib import Path
+import argparse
+import hashlib
+import sys
+from datetime import datetime
 import logging
 import pandas as pd
+import address
+import cube
+import etl
+import geocache
+import geocode
+import maps
+import nature
+import resolver
+import spatial
+import store
+import stream
+import summary
+import vis
 from etl import load_and_clean_xlsx
-from geocode import geocode_addresses
-from vis import build_charts, build_heatmap
+from geocache import open_cache
+from geocode import BACKENDS, LOCAL_CONFIDENCE, GeocodeEngine, geocode_addresses, make_backend
+from cube import build_cube, write_cube
+from nature import DEFAULT_RULES
+from metrics import PROFILE_DIR, REPORT_PATH, write_report
+from pipeline import ARTIFACT_DIR, Pipeline, Stage
+from spatial import HotspotIndex
+from store import IncidentWriter, write_incidents
+from summary import summarize, write_summary
+from stream import CHUNK_ROWS, stream_incidents
+from vis import build_heatmap, render_charts, write_heatmap
 
 RAW_DIR = Path('data/raw')
 OUT_DIR = Path('data')
@@ -15,8 +41,14 @@ CACHE_DIR = Path('cache')
 CHARTS_DIR = Path('charts')
 MAPS_DIR = Path('maps')
 BUILD_DIR = Path('build')
-CACHE_FILE = CACHE_DIR / 'geocode_cache.csv'
+CACHE_FILE = CACHE_DIR / 'geocode_cache.sqlite'
+LEGACY_CACHE_CSV = CACHE_DIR / 'geocode_cache.csv'
 CLEAN_CSV = OUT_DIR / 'clean_incidents.csv'
+STORE_DIR = OUT_DIR / 'incidents'
+CUBE_FILE = OUT_DIR / 'cube.parquet'
+BINS_FILE = OUT_DIR / 'spatial_bins.parquet'
+HEATMAP_FILE = MAPS_DIR / 'hotspots.html'
+SUMMARY_FILE = OUT_DIR / 'summary.json'
 
 logging.basicConfig(
     level=logging.INFO,
@@ -28,20 +60,184 @@ def ensure_dirs():
     for d in [RAW_DIR, OUT_DIR, CACHE_DIR, CHARTS_DIR, MAPS_DIR, BUILD_DIR]:
         d.mkdir(parents=True, exist_ok=True)
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Build the Alameda Police Data deliverables.')
+    parser.add_argument('--full-rebuild', action='store_true',
+                        help='Re-parse every raw workbook and redraw every chart instead of reusing cached output.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Processes used to parse raw workbooks and render charts (1 = serial); '
+                             'only pays off for large exports.')
+    parser.add_argument('--geocoder', choices=sorted(BACKENDS), default='nominatim',
+                        help='Geocoding backend for addresses missing from the cache.')
+    parser.add_argument('--geocoder-url',
+                        help='Endpoint of the self-hosted geocoder (e.g. http://localhost:8080).')
+    parser.add_argument('--geocode-workers', type=int, default=4,
+                        help='Concurrent geocoding requests.')
+    parser.add_argument('--geocode-rate', type=float,
+                        help='Requests per second across all workers (default: backend limit).')
+    parser.add_argument('--local-confidence', type=float, default=LOCAL_CONFIDENCE,
+                        help='Minimum confidence for offline intersection/house-number answers (>1 disables them).')
+    parser.add_argument('--export-csv', action='store_true',
+                        help=f'Also write the tidy CSV export to {CLEAN_CSV}.')
+    parser.add_argument('--stages', type=stage_list,
+                        help='Comma-separated stages to bring up to date (default: every output).')
+    parser.add_argument('--from', dest='start', metavar='STAGE',
+                        help='Re-run STAGE and everything downstream of it, reusing earlier artifacts.')
+    parser.add_argument('--force', type=stage_list, default=[],
+                        help='Comma-separated stages to re-run even if their artifacts are current.')
+    parser.add_argument('--jobs', type=int, default=2,
+                        help='Independent stages (charts, heatmap, store, cube) run at once.')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only print which stages would run.')
+    parser.add_argument('--profile', type=stage_list, default=[], metavar='STAGES',
+                        help=f'Comma-separated stages (or "all") to run under cProfile; stats go to {PROFILE_DIR}.')
+    parser.add_argument('--report', type=Path, default=REPORT_PATH,
+                        help='Where to write the JSON run report (timings, RSS, counters).')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Clean, geocode and aggregate raw rows in fixed-size chunks so memory stays flat.')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_ROWS,
+                        help='Raw rows per chunk with --streaming.')
+    args = parser.parse_args(argv)
+    if args.geocoder == 'selfhosted' and not args.geocoder_url:
+        parser.error('--geocoder selfhosted requires --geocoder-url')
+    return args
+
+def stage_list(text):
+    return [s.strip() for s in text.split(',') if s.strip()]
+
+def raw_inputs():
+    return sorted(RAW_DIR.glob('20*.xlsx')) + [DEFAULT_RULES]
+
+def retry_due():
+    """Hash of the cached misses now due for a retry, so the geocode key changes when one expires."""
+    with open_cache(CACHE_FILE, legacy_csv=LEGACY_CACHE_CSV) as cache:
+        due = cache.due()
+    return hashlib.sha256(repr(due).encode()).hexdigest()[:16] if due else None
+
+def build_pipeline(args):
+    """The build's stages; keys cover every input that changes a stage's result."""
+
+    def make_engine():
+        backend_args = {'url': args.geocoder_url} if args.geocoder == 'selfhosted' else {}
+        return GeocodeEngine(make_backend(args.geocoder, **backend_args),
+                             workers=args.geocode_workers, rate=args.geocode_rate)
+
+    def clean():
+        df = load_and_clean_xlsx(RAW_DIR, cache_dir=CACHE_DIR, force=args.full_rebuild, workers=args.workers)
+        logging.info(f'Loaded {len(df):,} records.')
+        return df
+
+    def geocoded(df):
+        with open_cache(CACHE_FILE, legacy_csv=LEGACY_CACHE_CSV) as cache:
+            return geocode_addresses(df, cache, engine=make_engine(), min_confidence=args.local_confidence)
+
+    def hotspots(df):
+        index = HotspotIndex.from_frame(df)
+        index.save(BINS_FILE)
+        return index
+
+    def count_cube(df):
+        counts = build_cube(df)
+        write_cube(counts, CUBE_FILE)
+        return counts
+
+    def report_summary(df, counts):
+        result = summarize(df, counts)
+        write_summary(result, SUMMARY_FILE)
+        return result
+
+    def charts(counts, index, report):
+        render_charts(counts, index, report, CHARTS_DIR, workers=args.workers, force=args.full_rebuild)
+
+    def heatmap(df):
+        build_heatmap(df, MAPS_DIR)
+
+    def incident_store(df):
+        write_incidents(df, STORE_DIR)
+
+    def tidy_csv(df):
+        df.to_csv(CLEAN_CSV, index=False)
+
+    geocode_params = {'geocoder': args.geocoder, 'url': args.geocoder_url, 'local_confidence': args.local_confidence,
+                      'retry_due': retry_due()}
+    if args.streaming:
+        return streaming_pipeline(args, make_engine, geocode_params)
+    return Pipeline([
+        Stage('clean', clean, code=[etl, nature, address], files=raw_inputs, persist=True),
+        Stage('geocode', geocoded, ['clean'], params=geocode_params,
+              code=[geocode, resolver, geocache, address], persist=True),
+        Stage('hotspots', hotspots, ['geocode'], outputs=[BINS_FILE], code=[spatial], persist=True),
+        Stage('cube', count_cube, ['geocode'], outputs=[CUBE_FILE], code=[cube], persist=True),
+        Stage('summary', report_summary, ['geocode', 'cube'], outputs=[SUMMARY_FILE], code=[summary], persist=True),
+        Stage('charts', charts, ['cube', 'hotspots', 'summary'], outputs=[CHARTS_DIR], code=[vis, spatial]),
+        Stage('heatmap', heatmap, ['geocode'], outputs=[HEATMAP_FILE], code=[vis, maps]),
+        Stage('store', incident_store, ['geocode'], outputs=[STORE_DIR], code=[store]),
+        Stage('csv', tidy_csv, ['geocode'], outputs=[CLEAN_CSV]),
+    ], ARTIFACT_DIR, profile=args.profile)
+
+def streaming_pipeline(args, make_engine, geocode_params):
+    """Stages for --streaming: one pass over the raw rows builds the store and every aggregate."""
+
+    def streamed():
+        writer = IncidentWriter(STORE_DIR)
+        with open_cache(CACHE_FILE, legacy_csv=LEGACY_CACHE_CSV) as cache:
+            aggregates = stream_incidents(sorted(RAW_DIR.glob('20*.xlsx')), cache, make_engine(),
+                                          chunk_rows=args.chunk_size, writer=writer,
+                                          csv_path=CLEAN_CSV if args.export_csv else None,
+                                          min_confidence=args.local_confidence)
+        writer.close()
+        logging.info(f'Streamed {aggregates.rows:,} records.')
+        return aggregates
+
+    def hotspots(aggregates):
+        index = aggregates.hotspots()
+        index.save(BINS_FILE)
+        return index
+
+    def count_cube(aggregates):
+        write_cube(aggregates.cube, CUBE_FILE)
+        return aggregates.cube
+
+    def report_summary(aggregates):
+        result = aggregates.summary()
+        write_summary(result, SUMMARY_FILE)
+        return result
+
+    def charts(counts, index, report):
+        render_charts(counts, index, report, CHARTS_DIR, workers=args.workers, force=args.full_rebuild)
+
+    def heatmap(aggregates):
+        write_heatmap(aggregates.layers(), MAPS_DIR)
+
+    outputs = [STORE_DIR] + ([CLEAN_CSV] if args.export_csv else [])
+    return Pipeline([
+        Stage('stream', streamed, outputs=outputs, params=dict(geocode_params, export_csv=args.export_csv),
+              code=[stream, etl, nature, address, geocode, resolver, geocache, store, cube, spatial, maps],
+              files=raw_inputs, persist=True),
+        Stage('hotspots', hotspots, ['stream'], outputs=[BINS_FILE], code=[spatial], persist=True),
+        Stage('cube', count_cube, ['stream'], outputs=[CUBE_FILE], code=[cube], persist=True),
+        Stage('summary', report_summary, ['stream'], outputs=[SUMMARY_FILE], code=[summary], persist=True),
+        Stage('charts', charts, ['cube', 'hotspots', 'summary'], outputs=[CHARTS_DIR], code=[vis, spatial]),
+        Stage('heatmap', heatmap, ['stream'], outputs=[HEATMAP_FILE], code=[vis, maps]),
+    ], ARTIFACT_DIR, profile=args.profile)
+
+def main(argv=None):
+    args = parse_args(argv)
     logging.info('Starting Alameda Police Data build process.')
     ensure_dirs()
-    logging.info('Loading and cleaning Excel files...')
-    df = load_and_clean_xlsx(RAW_DIR)
-    logging.info(f'Loaded {len(df):,} records.')
-    logging.info('Geocoding addresses (with cache)...')
-    df = geocode_addresses(df, CACHE_FILE)
-    logging.info('Building static charts...')
-    build_charts(df, CHARTS_DIR)
-    logging.info('Building heatmap...')
-    build_heatmap(df, MAPS_DIR)
-    logging.info(f'Writing tidy CSV to {CLEAN_CSV}')
-    df.to_csv(CLEAN_CSV, index=False)
+    pipeline = build_pipeline(args)
+    targets = args.stages or [n for n in pipeline.stages if n != 'csv' or args.export_csv]
+    force = list(pipeline.stages) if args.full_rebuild else args.force
+    if args.dry_run:
+        plan = pipeline.plan(targets, args.start, force)
+        print('\n'.join(plan) if plan else 'Everything is up to date.')
+        return
+    started = datetime.now().isoformat(timespec='seconds')
+    try:
+        pipeline.run(targets, start=args.start, force=force, jobs=args.jobs)
+    finally:
+        write_report(args.report, started=started, argv=argv if argv is not None else sys.argv[1:],
+                     targets=targets, keys=pipeline.keys())
     logging.info('Build complete. See /build for deliverables.')
 
 if __name__ == '__main__':
@@ -0,0 +1,190 @@
+"""
+Map building for Alameda Police Data.
+
+Incidents are collapsed to one record per distinct location before any
+folium object is created. Markers are emitted as a single JSON payload
+and clustered in the browser (FastMarkerCluster), and the heat layer
+gets one weighted point per ~10 m cell. Page size follows the number of
+distinct locations, not the number of incidents. Rendered HTML is
+cached on disk per data/filter combination, keeping the MAP_CACHE_MAX
+most recently used pages. The location and heat
+aggregates are mergeable, so streaming builds can assemble them chunk
+by chunk.
+"""
+
+import hashlib
+import html
+import logging
+from pathlib import Path
+import folium
+import numpy as np
+import pandas as pd
+from folium.plugins import FastMarkerCluster, Fullscreen, HeatMap
+
+MAP_VERSION = 2  # bump when the map layout changes to invalidate cached HTML
+HEAT_PRECISION = 4  # decimal places of the heat grid (~10 m)
+MAP_CACHE_MAX = 32  # cached map pages kept per cache directory
+
+MARKER_CALLBACK = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindTooltip(row[3]);
+    marker.bindPopup('<b>Incidents:</b> ' + row[2] + '<br><b>Latest:</b> ' + row[4]
+        + '<br><b>Type:</b> ' + row[3] + '<br><b>Address:</b> ' + row[5], {maxWidth: 300});
+    return marker;
+};
+"""
+
+
+def location_counts(df, label_col='nature'):
+    """Incidents and latest date per location, address and label.
+
+    Partial aggregate: frames from disjoint incidents add up with
+    merge_location_counts(), and summarize_locations() turns the result
+    into one row per location.
+    """
+    map_df = df.dropna(subset=['lat', 'lon'])
+    keys = ['lat', 'lon', 'address', 'label']
+    map_df = pd.DataFrame({'lat': map_df['lat'].astype(float), 'lon': map_df['lon'].astype(float),
+                           'address': map_df['address'].astype(str), 'label': map_df[label_col].astype(str),
+                           'reported_dt': map_df['reported_dt']})
+    grouped = map_df.groupby(keys, sort=False)
+    return pd.DataFrame({'incidents': grouped.size(), 'latest': grouped['reported_dt'].max()}).reset_index()
+
+
+def merge_location_counts(*frames):
+    frames = [f for f in frames if f is not None]
+    merged = pd.concat(frames, ignore_index=True).groupby(['lat', 'lon', 'address', 'label'], sort=False)
+    return merged.agg(incidents=('incidents', 'sum'), latest=('latest', 'max')).reset_index()
+
+
+def _most_common(counts, col):
+    """Per location, the value of col with the most incidents (ties: first in sort order)."""
+    by = counts.groupby(['lat', 'lon', col], sort=True)['incidents'].sum().reset_index()
+    by = by.sort_values('incidents', ascending=False, kind='stable').drop_duplicates(['lat', 'lon'])
+    return by.set_index(['lat', 'lon'])[col]
+
+
+def summarize_locations(counts):
+    """One row per distinct location: count, most common label, latest date, address."""
+    if counts.empty:
+        return pd.DataFrame({c: pd.Series(dtype=object) for c in ['lat', 'lon', 'incidents', 'label', 'latest', 'address']})
+    grouped = counts.groupby(['lat', 'lon'], sort=True)
+    summary = grouped['incidents'].sum().to_frame()
+    summary['label'] = _most_common(counts, 'label')
+    summary['latest'] = grouped['latest'].max().astype(str)
+    summary['address'] = _most_common(counts, 'address')
+    return summary.reset_index()
+
+
+def location_summary(df, label_col='nature'):
+    """One row per distinct location: count, most common label, latest date, address."""
+    return summarize_locations(location_counts(df, label_col))
+
+
+def heat_points(df, precision=HEAT_PRECISION):
+    """Weighted heat points, binned to a grid of the given precision."""
+    map_df = df.dropna(subset=['lat', 'lon'])
+    binned = pd.DataFrame({'lat': map_df['lat'].astype(float).round(precision),
+                           'lon': map_df['lon'].astype(float).round(precision)})
+    return binned.groupby(['lat', 'lon']).size().reset_index(name='weight')
+
+
+def merge_heat_points(*frames):
+    frames = [f for f in frames if f is not None]
+    return pd.concat(frames, ignore_index=True).groupby(['lat', 'lon'])['weight'].sum().reset_index()
+
+
+def _weighted_median(values, weights):
+    """Median of values repeated weights times (same as Series.median on the rows)."""
+    order = np.argsort(values, kind='stable')
+    values, cum = np.asarray(values)[order], np.cumsum(np.asarray(weights)[order])
+    total = cum[-1]
+    lo = values[np.searchsorted(cum, (total + 1) // 2)]
+    hi = values[np.searchsorted(cum, total // 2 + 1)]
+    return float((lo + hi) / 2)
+
+
+def layers_from_counts(counts, heat):
+    """Map layers (location summary, heat points, center) from merged partials."""
+    summary = summarize_locations(counts)
+    if summary.empty:
+        return summary, heat, None
+    weights = summary['incidents'].to_numpy()
+    center = [_weighted_median(summary['lat'].to_numpy(), weights),
+              _weighted_median(summary['lon'].to_numpy(), weights)]
+    return summary, heat, center
+
+
+def map_layers(df, label_col='nature'):
+    """Aggregated inputs of a map: location summary, heat points and center."""
+    return layers_from_counts(location_counts(df, label_col), heat_points(df))
+
+
+def render_map(summary, heat, center):
+    """Folium map with a binned heat layer and client-side clustered markers."""
+    # Center map on median
+    m = folium.Map(location=center, zoom_start=13)
+    Fullscreen().add_to(m)
+    if summary.empty:
+        return m
+    HeatMap(
+        data=heat.values.tolist(),
+        radius=10, blur=7, min_opacity=0.4, max_zoom=1,
+        name='Heatmap',
+    ).add_to(m)
+    payload = [
+        [float(lat), float(lon), int(n), html.escape(label), html.escape(latest), html.escape(addr)]
+        for lat, lon, n, label, latest, addr in summary.itertuples(index=False, name=None)
+    ]
+    FastMarkerCluster(payload, callback=MARKER_CALLBACK, name='Incidents').add_to(m)
+    folium.LayerControl().add_to(m)
+    return m
+
+
+def build_map(df, label_col='nature'):
+    return render_map(*map_layers(df, label_col))
+
+
+def map_key(summary, heat, center, **filters):
+    """Content hash of a map's aggregated layers plus its filters."""
+    h = hashlib.sha256(repr((MAP_VERSION, center, sorted(filters.items()))).encode())
+    for frame in (summary, heat):
+        h.update(pd.util.hash_pandas_object(frame, index=False).values.tobytes())
+    return h.hexdigest()[:16]
+
+
+def cached_map_html(df, cache_dir, label_col='nature', **filters):
+    """Rendered map HTML for df, reusing the on-disk copy when nothing changed.
+
+    filters only label the cache entry (e.g. groups=('TRAFFIC',)); apply
+    them to df before calling.
+    """
+    return cached_layers_html(map_layers(df, label_col), cache_dir, label=label_col, **filters)
+
+
+def prune_map_cache(cache_dir, keep=MAP_CACHE_MAX):
+    """Delete all but the keep most recently used cached map pages."""
+    pages = sorted(Path(cache_dir).glob('map_*.html'), key=lambda p: p.stat().st_mtime_ns, reverse=True)
+    for path in pages[keep:]:
+        path.unlink(missing_ok=True)
+        logging.info(f'Evicted cached map {path.name}')
+
+
+def cached_layers_html(layers, cache_dir, **filters):
+    """Rendered map HTML for precomputed map layers, cached on disk.
+
+    A page's mtime marks its last use; past MAP_CACHE_MAX pages the
+    least recently used are evicted.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    path = cache_dir / f'map_{map_key(*layers, **filters)}.html'
+    if path.exists():
+        logging.info(f'Reusing cached map {path.name}')
+        path.touch()
+        return path.read_text()
+    page = render_map(*layers).get_root().render()
+    path.write_text(page)
+    prune_map_cache(cache_dir, MAP_CACHE_MAX)
+    return page
@@ -0,0 +1,165 @@
+"""
+Build metrics for Alameda Police Data.
+
+measure() times a block: wall time, CPU time of the calling thread,
+the process's peak RSS and optional rows in/out. count() and observe()
+keep counters and latency samples (geocode cache hits, backend request
+time, ...). All of it lands in the module-level METRICS registry, which
+main writes as a JSON run report and appends to a history file for
+run-over-run comparison.
+
+Work done in pool processes is captured there with capture() and folded
+back into the parent with METRICS.merge().
+
+profiled() wraps a block in cProfile when asked to and dumps the stats
+next to the report.
+"""
+
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+
+REPORT_PATH = Path('cache/run_report.json')
+HISTORY_PATH = Path('cache/run_history.jsonl')
+PROFILE_DIR = Path('cache/profiles')
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes elsewhere
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+class Metrics:
+    """Thread-safe registry of timed steps, counters and samples."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.steps = []
+            self.counters = {}
+            self.samples = {}
+
+    @contextmanager
+    def measure(self, name, rows_in=None):
+        """Time the block; set step['rows_out'] on the yielded dict if known."""
+        step = {'name': name, 'rows_in': rows_in, 'rows_out': None}
+        wall, cpu = time.perf_counter(), time.thread_time()
+        rss_before = peak_rss_mb()
+        try:
+            yield step
+        finally:
+            step['wall_s'] = round(time.perf_counter() - wall, 4)
+            step['cpu_s'] = round(time.thread_time() - cpu, 4)
+            step['peak_rss_mb'] = round(peak_rss_mb(), 1)
+            step['rss_growth_mb'] = round(step['peak_rss_mb'] - rss_before, 1)
+            step['pid'] = os.getpid()
+            with self.lock:
+                self.steps.append(step)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        with self.lock:
+            self.samples.setdefault(name, []).append(value)
+
+    def snapshot(self):
+        """Picklable copy of everything recorded, for merge()."""
+        with self.lock:
+            return {'steps': list(self.steps), 'counters': dict(self.counters),
+                    'samples': {k: list(v) for k, v in self.samples.items()}}
+
+    def merge(self, snap):
+        with self.lock:
+            self.steps.extend(snap['steps'])
+            for name, n in snap['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            for name, values in snap['samples'].items():
+                self.samples.setdefault(name, []).extend(values)
+
+    def report(self):
+        """Run report: steps in order of completion, counters and sample summaries."""
+        snap = self.snapshot()
+        summaries = {}
+        for name, values in snap['samples'].items():
+            arr = np.asarray(values, dtype=float)
+            summaries[name] = {'n': len(arr), 'total': round(float(arr.sum()), 4),
+                               'mean': round(float(arr.mean()), 4),
+                               'p50': round(float(np.percentile(arr, 50)), 4),
+                               'p95': round(float(np.percentile(arr, 95)), 4),
+                               'max': round(float(arr.max()), 4)}
+        return {'steps': snap['steps'], 'counters': snap['counters'], 'samples': summaries,
+                'peak_rss_mb': round(peak_rss_mb(), 1)}
+
+
+METRICS = Metrics()
+measure = METRICS.measure
+count = METRICS.count
+observe = METRICS.observe
+
+
+def capture(func, *args):
+    """Run func in a pool process; return (result, metrics snapshot)."""
+    METRICS.reset()
+    result = func(*args)
+    return result, METRICS.snapshot()
+
+
+def rows(obj):
+    """Row count of a frame-like result, else None."""
+    return len(obj) if hasattr(obj, 'columns') else None
+
+
+@contextmanager
+def profiled(name, enabled=True, out_dir=PROFILE_DIR, top=25):
+    """cProfile the block (current thread only) and dump <name>.prof and <name>.txt."""
+    if not enabled:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(out_dir / f'{name}.prof')
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(top)
+        (out_dir / f'{name}.txt').write_text(text.getvalue())
+        logging.info(f'Profile for {name} written to {out_dir / name}.prof')
+
+
+def write_report(path=REPORT_PATH, history=HISTORY_PATH, **run_info):
+    """Write the JSON run report and append a one-line summary to history."""
+    report = {'started': run_info.pop('started', None), 'finished': datetime.now().isoformat(timespec='seconds'),
+              'run': run_info, **METRICS.report()}
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=2, default=str))
+    if history:
+        stages = {s['name']: s['wall_s'] for s in report['steps'] if s['name'].startswith('stage.')}
+        line = {'finished': report['finished'], 'stages': stages, 'counters': report['counters'],
+                'peak_rss_mb': report['peak_rss_mb']}
+        with open(history, 'a') as fh:
+            fh.write(json.dumps(line, default=str) + '\n')
+    logging.info(f'Run report written to {path}')
+    return report
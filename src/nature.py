@@ -0,0 +1,99 @@
+"""
+Nature code classifier for Alameda Police Data ETL.
+
+Group rules live in nature_groups.md: the "Keyword Rules" section lists
+substring rules in precedence order, and "Incident Types by Group" pins
+individual codes to a group. Pinned codes win over keywords.
+"""
+
+import re
+import logging
+from pathlib import Path
+
+DEFAULT_RULES = Path(__file__).resolve().parents[1] / 'nature_groups.md'
+DEFAULT_GROUP = 'OTHER'
+_RULES_CACHE = {}  # resolved path -> (mtime_ns, parsed rules)
+
+
+def load_rules(path=DEFAULT_RULES):
+    """Parse nature_groups.md into keyword rules and pinned codes.
+
+    The parse is cached until the file's mtime changes, so recoding a
+    stream of chunks reads the rules once.
+    """
+    path = Path(path).resolve()
+    mtime = path.stat().st_mtime_ns
+    cached = _RULES_CACHE.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    keywords = []
+    codes = {}
+    section = group = None
+    for line in path.read_text().splitlines():
+        line = line.strip()
+        if line.startswith('# '):
+            section = line[2:].strip().lower()
+            group = None
+        elif line.startswith('## '):
+            group = line[3:].strip().upper()
+        elif line.startswith('- ') and section == 'keyword rules' and ':' in line:
+            grp, words = line[2:].split(':', 1)
+            keywords.append((grp.strip().upper(), [w.strip().upper() for w in words.split(',') if w.strip()]))
+        elif line.startswith('- ') and group:
+            codes[line[2:].strip().upper()] = group
+    rules = {'keywords': keywords, 'codes': codes}
+    _RULES_CACHE[path] = (mtime, rules)
+    return rules
+
+
+def compile_rules(rules):
+    """Build one regex matching every keyword at every position.
+
+    The lookahead makes overlapping keywords all visible, so the winning
+    group is the one with the highest precedence, not the leftmost match.
+    """
+    rank = {}
+    for i, (grp, words) in enumerate(rules['keywords']):
+        for w in words:
+            rank.setdefault(w, (i, grp))
+    if not rank:
+        return None, rank
+    alternation = '|'.join(re.escape(w) for w in sorted(rank, key=len, reverse=True))
+    return re.compile(f'(?=({alternation}))'), rank
+
+
+def classify_codes(codes, rules):
+    """Map each distinct code to its group.
+
+    Returns the mapping and the sorted codes that fell through to OTHER
+    without being pinned there.
+    """
+    matcher, rank = compile_rules(rules)
+    pinned = rules['codes']
+    mapping = {}
+    fell_through = []
+    for code in codes:
+        if code in pinned:
+            mapping[code] = pinned[code]
+            continue
+        hits = [rank[m.group(1)] for m in matcher.finditer(code)] if matcher else []
+        if hits:
+            mapping[code] = min(hits)[1]
+        else:
+            mapping[code] = DEFAULT_GROUP
+            fell_through.append(code)
+    return mapping, sorted(fell_through)
+
+
+def recode_nature(nature, rules_path=DEFAULT_RULES):
+    """Return nature groups for a nature series as a categorical.
+
+    Each distinct code is classified once and the result is mapped back
+    to all rows through the categorical codes.
+    """
+    cat = nature.astype('category')
+    mapping, fell_through = classify_codes(cat.cat.categories, load_rules(rules_path))
+    if fell_through:
+        logging.warning(f'{len(fell_through)} nature codes fell through to {DEFAULT_GROUP}: {fell_through}')
+    groups = cat.map(mapping)
+    return groups.astype('category')
@@ -0,0 +1,207 @@
+"""
+Stage-based build pipeline for Alameda Police Data.
+
+A build is a list of named Stages. Each stage declares the stages it
+reads from, the parameters and source modules that shape its result,
+and any files it writes. Its key is a hash of all of those plus its
+input stages' keys, so it is known before anything runs.
+
+Stages with persist=True (the cleaned and geocoded frames, the hotspot
+index) pickle their result to cache/artifacts/<stage>-<key>.pkl. Sink
+stages that only write files leave a small marker instead. A stage is
+skipped when an artifact or marker with its current key exists and its
+declared outputs are on disk; its result is then loaded from the
+artifact if a downstream stage needs it. A failed build therefore
+resumes from the last good artifact, and editing a chart only re-runs
+the charts stage.
+
+Stages whose inputs are ready run concurrently on a thread pool, so
+charts, heatmap, store and cube overlap once geocoding is done. Each
+stage is timed into metrics.METRICS, and stages listed in profile run
+under cProfile.
+"""
+
+import hashlib
+import json
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+import pandas as pd
+from metrics import count, measure, profiled, rows
+
+ARTIFACT_DIR = Path('cache/artifacts')
+
+
+class Stage:
+    """One named build step: run(*inputs) returns the stage's result.
+
+    inputs: names of the stages whose results are passed to run, in order.
+    outputs: files or directories the stage writes; missing ones force a re-run.
+    params: values that change the result (hashed into the key).
+    code: modules whose source changes the result (hashed into the key).
+    files: paths, or a callable returning paths, whose size/mtime are hashed.
+    persist: pickle the result as an artifact; otherwise keep a marker.
+    """
+
+    def __init__(self, name, run, inputs=(), outputs=(), params=None, code=(), files=(), persist=False):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = [Path(p) for p in outputs]
+        self.params = params or {}
+        self.code = list(code)
+        self.files = files
+        self.persist = persist
+
+    def fingerprint(self):
+        """Hash of the stage's own parameters, code and input files."""
+        h = hashlib.sha256(repr((self.name, sorted(self.params.items()))).encode())
+        for module in self.code:
+            h.update(Path(module.__file__).read_bytes())
+        files = self.files() if callable(self.files) else self.files
+        for path in sorted(Path(p) for p in files):
+            stat = path.stat()
+            h.update(repr((path.name, stat.st_size, stat.st_mtime_ns)).encode())
+        return h.hexdigest()
+
+
+class Pipeline:
+    """Runs Stages in dependency order, reusing artifacts whose key is current."""
+
+    def __init__(self, stages, artifact_dir=ARTIFACT_DIR, profile=()):
+        self.stages = {}
+        for stage in stages:
+            missing = [i for i in stage.inputs if i not in self.stages]
+            if missing:
+                raise ValueError(f'Stage {stage.name} depends on unknown or later stages: {missing}')
+            self.stages[stage.name] = stage
+        self.artifact_dir = Path(artifact_dir)
+        self.profile = set(self.stages) if 'all' in profile else set(profile)
+        self._keys = None
+
+    def keys(self):
+        """Key of every stage, from its fingerprint and its inputs' keys."""
+        if self._keys is None:
+            keys = {}
+            for name, stage in self.stages.items():
+                h = hashlib.sha256(stage.fingerprint().encode())
+                for dep in stage.inputs:
+                    h.update(keys[dep].encode())
+                keys[name] = h.hexdigest()[:16]
+            self._keys = keys
+        return self._keys
+
+    def _check(self, names):
+        """Raise ValueError for the first of names that is not a stage."""
+        for name in names:
+            if name not in self.stages:
+                raise ValueError(f'Unknown stage: {name}')
+
+    def upstream(self, names):
+        """names plus every stage they depend on, in pipeline order."""
+        needed = set()
+        todo = list(names)
+        while todo:
+            name = todo.pop()
+            if name not in self.stages:
+                raise ValueError(f'Unknown stage: {name}')
+            if name not in needed:
+                needed.add(name)
+                todo.extend(self.stages[name].inputs)
+        return [n for n in self.stages if n in needed]
+
+    def downstream(self, names):
+        """names plus every stage that depends on them, in pipeline order."""
+        self._check(names)
+        found = set(names)
+        for name, stage in self.stages.items():
+            if found.intersection(stage.inputs):
+                found.add(name)
+        return [n for n in self.stages if n in found]
+
+    def _artifact(self, name):
+        suffix = 'pkl' if self.stages[name].persist else 'done'
+        return self.artifact_dir / f'{name}-{self.keys()[name]}.{suffix}'
+
+    def is_current(self, name):
+        stage = self.stages[name]
+        return self._artifact(name).exists() and all(p.exists() for p in stage.outputs)
+
+    def plan(self, targets=None, start=None, force=()):
+        """Stages that must run to bring targets up to date."""
+        targets = list(targets or self.stages)
+        needed = self.upstream(targets)
+        self._check(force)
+        forced = set(force)
+        if start:
+            forced.update(self.downstream([start]))
+        run = []
+        for name in needed:
+            if name in forced or not self.is_current(name):
+                run.append(name)
+        # A stage whose result is needed but cannot be loaded must run too
+        for name in reversed(needed):
+            for dep in self.stages[name].inputs:
+                if name in run and dep not in run and not self.stages[dep].persist:
+                    run.append(dep)
+        return [n for n in needed if n in run]
+
+    def _load(self, name):
+        logging.info(f'Reusing {name} artifact {self._artifact(name).name}')
+        return pd.read_pickle(self._artifact(name))
+
+    def _save(self, name, result):
+        self.artifact_dir.mkdir(parents=True, exist_ok=True)
+        # Keep one artifact per stage
+        for old in self.artifact_dir.glob(f'{name}-*'):
+            old.unlink()
+        path = self._artifact(name)
+        tmp = path.with_suffix('.tmp')
+        if self.stages[name].persist:
+            pd.to_pickle(result, tmp)
+        else:
+            tmp.write_text(json.dumps({'stage': name, 'key': self.keys()[name]}))
+        tmp.replace(path)
+
+    def run(self, targets=None, start=None, force=(), jobs=1):
+        """Run the stages needed for targets; returns the results held in memory."""
+        to_run = self.plan(targets, start, force)
+        skipped = [n for n in self.upstream(targets or self.stages) if n not in to_run]
+        if skipped:
+            logging.info(f'Up to date: {", ".join(skipped)}')
+            count('pipeline.stages_skipped', len(skipped))
+        if not to_run:
+            return {}
+        logging.info(f'Running stages: {", ".join(to_run)}')
+        results = {}
+
+        def inputs_of(name):
+            for dep in self.stages[name].inputs:
+                if dep not in results:
+                    results[dep] = self._load(dep)
+            return [results[dep] for dep in self.stages[name].inputs]
+
+        def execute(name, args):
+            logging.info(f'Stage {name}: start')
+            rows_in = sum(rows(a) or 0 for a in args) if args else None
+            with measure(f'stage.{name}', rows_in=rows_in) as step, profiled(name, name in self.profile):
+                result = self.stages[name].run(*args)
+                step['rows_out'] = rows(result)
+            self._save(name, result)
+            logging.info(f'Stage {name}: done')
+            return result
+
+        pending = list(to_run)
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            running = {}
+            while pending or running:
+                ready = [n for n in pending
+                         if not any(dep in pending or dep in running.values() for dep in self.stages[n].inputs)]
+                for name in ready[:max(1, jobs) - len(running)]:
+                    pending.remove(name)
+                    running[pool.submit(execute, name, inputs_of(name))] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    results[name] = future.result()
+        return results
@@ -0,0 +1,150 @@
+"""
+Indexed incident queries for Alameda Police Data.
+
+IncidentIndex answers filtered row lookups ("TRAFFIC incidents in PD8
+between two dates inside this bounding box") without scanning every
+incident:
+
+- rows are held sorted by reported_dt, so a time window is a pair of
+  binary searches and a contiguous row range;
+- nature_grp, nature, area and agency have one packed bitmap per value
+  (a bit per row); a query ORs the bitmaps of the wanted values within a
+  column, ANDs across columns, and only touches the bytes covering the
+  time window;
+- located rows are bucketed on a GRID_CELL_M square grid (CSR layout:
+  row positions sorted by cell plus per-cell offsets), so a bounding box
+  only visits the rows of the cells it overlaps.
+
+Results come back in time order. A query that selects a contiguous row
+range (a time window alone) is returned as a slice of the sorted frame
+rather than a copy.
+"""
+
+import logging
+import numpy as np
+import pandas as pd
+from spatial import Grid
+from store import STORE_DIR, read_incidents
+
+BITMAP_COLUMNS = ['nature_grp', 'nature', 'area', 'agency']
+INDEX_COLUMNS = ['incident_id', 'reported_dt', 'nature', 'nature_grp', 'area', 'agency', 'address', 'lat', 'lon']
+GRID_CELL_M = 250.0
+
+
+def _pack(positions, n):
+    """Packed bitmap of n bits with the given positions set."""
+    bits = np.zeros(n, dtype=bool)
+    bits[positions] = True
+    return np.packbits(bits)
+
+
+class IncidentIndex:
+    """Time-sorted incidents with bitmap and spatial grid indexes."""
+
+    def __init__(self, df, grid=None):
+        order = np.argsort(df['reported_dt'].to_numpy(), kind='stable')
+        self.df = df.take(order).reset_index(drop=True)
+        self.times = self.df['reported_dt'].to_numpy()
+        n = len(self.df)
+        # Bitmap index: value -> packed bitmap, per column
+        self.bitmaps = {}
+        for col in BITMAP_COLUMNS:
+            if col not in self.df.columns:
+                continue
+            values = self.df[col].astype('category')
+            codes = values.cat.codes.to_numpy()
+            by_code = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[by_code], np.arange(len(values.cat.categories) + 1))
+            self.bitmaps[col] = {value: _pack(by_code[bounds[i]:bounds[i + 1]], n)
+                                 for i, value in enumerate(values.cat.categories)}
+        # Spatial index: located row positions grouped by grid cell
+        self.grid = grid or Grid(GRID_CELL_M)
+        self.lat, self.lon = lat, lon = self.df['lat'].to_numpy(dtype=float), self.df['lon'].to_numpy(dtype=float)
+        located = np.flatnonzero(~np.isnan(lat) & ~np.isnan(lon))
+        self.located = _pack(located, n)
+        ix, iy = self.grid.to_cells(lat[located], lon[located])
+        keys = (ix.astype('int64') << 32) | (iy.astype('int64') & 0xFFFFFFFF)
+        by_cell = np.argsort(keys, kind='stable')
+        self.cell_rows = located[by_cell]
+        cell_keys, starts = np.unique(keys[by_cell], return_index=True)
+        self.cell_ix = (cell_keys >> 32).astype('int32')
+        self.cell_iy = (cell_keys & 0xFFFFFFFF).astype('uint32').astype('int32')
+        self.cell_start = np.append(starts, len(located))
+        logging.info(f'Indexed {n:,} incidents ({len(cell_keys):,} grid cells)')
+
+    @classmethod
+    def from_store(cls, root=STORE_DIR, columns=INDEX_COLUMNS):
+        return cls(read_incidents(root, columns=list(columns)))
+
+    def __len__(self):
+        return len(self.df)
+
+    def _window(self, start, end):
+        """Row range [lo, hi) with start <= reported_dt < end."""
+        def bound(value, default):
+            if value is None:
+                return default
+            # Search in the column's own unit; a mismatched unit converts the whole array
+            return int(np.searchsorted(self.times, pd.Timestamp(value).to_datetime64().astype(self.times.dtype)))
+        lo, hi = bound(start, 0), bound(end, len(self.times))
+        return lo, max(lo, hi)
+
+    def _bits(self, lo, hi, filters, located):
+        """Boolean mask over rows lo..hi-1 from the bitmap filters, or None if unfiltered."""
+        b0, b1 = lo // 8, -(-hi // 8)
+        acc = self.located[b0:b1].copy() if located else None
+        for col, values in filters.items():
+            if col not in self.bitmaps:
+                raise ValueError(f'No bitmap index on {col!r}; indexed columns: {list(self.bitmaps)}')
+            bitmaps = self.bitmaps[col]
+            hits = np.zeros(b1 - b0, dtype=np.uint8)
+            for value in values:
+                if value in bitmaps:
+                    hits |= bitmaps[value][b0:b1]
+            acc = hits if acc is None else acc & hits
+        if acc is None:
+            return None
+        return np.unpackbits(acc)[lo - b0 * 8:hi - b0 * 8].view(bool)
+
+    def _in_bbox(self, bbox):
+        """Sorted positions of rows inside bbox = (lon_min, lon_max, lat_min, lat_max)."""
+        lon_min, lon_max, lat_min, lat_max = bbox
+        ix0, iy0 = self.grid.to_cells(lat_min, lon_min)
+        ix1, iy1 = self.grid.to_cells(lat_max, lon_max)
+        cells = np.flatnonzero((self.cell_ix >= ix0) & (self.cell_ix <= ix1) &
+                               (self.cell_iy >= iy0) & (self.cell_iy <= iy1))
+        if not len(cells):
+            return np.zeros(0, dtype='int64')
+        rows = np.concatenate([self.cell_rows[self.cell_start[c]:self.cell_start[c + 1]] for c in cells])
+        # Cells on the edge of the box hold rows outside it
+        lat, lon = self.lat[rows], self.lon[rows]
+        rows = rows[(lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)]
+        return np.sort(rows)
+
+    def positions(self, start=None, end=None, bbox=None, located=False, **filters):
+        """Matching row positions in the sorted frame: a slice when contiguous, else an array.
+
+        start/end bound reported_dt (end exclusive); bbox is
+        (lon_min, lon_max, lat_min, lat_max); located keeps only geocoded
+        rows; filters map bitmap columns to a value or list of values.
+        """
+        filters = {col: [v] if isinstance(v, str) or not np.iterable(v) else list(v) for col, v in filters.items()}
+        lo, hi = self._window(start, end)
+        bits = self._bits(lo, hi, filters, located and bbox is None)
+        if bbox is not None:
+            rows = self._in_bbox(bbox)
+            rows = rows[(rows >= lo) & (rows < hi)]
+            return rows[bits[rows - lo]] if bits is not None else rows
+        if bits is None or bits.all():
+            return slice(lo, hi)
+        return lo + np.flatnonzero(bits)
+
+    def query(self, start=None, end=None, bbox=None, located=False, columns=None, **filters):
+        """Matching incidents in time order (see positions()), optionally projected to columns."""
+        rows = self.positions(start, end, bbox, located, **filters)
+        frame = self.df if columns is None else self.df[list(columns)]
+        return frame.iloc[rows]
+
+    def count(self, start=None, end=None, bbox=None, located=False, **filters):
+        rows = self.positions(start, end, bbox, located, **filters)
+        return rows.stop - rows.start if isinstance(rows, slice) else len(rows)
@@ -0,0 +1,230 @@
+"""
+Offline address resolver for Alameda Police Data geocoding.
+
+Builds a street gazetteer from addresses the network geocoder already
+resolved: for every street, the known house numbers and their
+coordinates. From that it can
+
+- interpolate an unseen house number along a known street, and
+- intersect two streets ("CEDAR & WAYNE") by fitting a line to each.
+
+Every answer carries a confidence in [0, 1]; callers only fall back to
+the network geocoder when it is low.
+"""
+
+import re
+import logging
+import numpy as np
+import pandas as pd
+from address import DIRECTIONAL_ABBREVS, SUFFIX_ABBREVS, INTERSECTION_RE, canonical_street
+
+NUMBER_RE = re.compile(r'^(\d+)\s+(.+)$')
+
+M_PER_DEG_LAT = 110540.0
+M_PER_DEG_LON = 111320.0
+MIN_ANGLE = np.sin(np.radians(20))  # streets closer to parallel than this don't intersect
+EXTENT_MARGIN = 250.0  # metres an intersection may lie beyond a street's known points
+MAX_RMS = 60.0  # metres of scatter around a fitted street line before it counts as curved
+MAX_GAP = 400  # house numbers between known points before interpolation is trusted less
+
+
+def split_address(addr):
+    """Split 'street part, locality' on the first comma."""
+    street, _, locality = str(addr).partition(',')
+    return street.strip(), locality.strip()
+
+
+def base_name(street):
+    """Street name without leading directional or trailing suffix: 'E CEDAR ST' -> 'CEDAR'."""
+    tokens = street.split()
+    if len(tokens) > 1 and tokens[0] in DIRECTIONAL_ABBREVS:
+        tokens = tokens[1:]
+    if len(tokens) > 1 and tokens[-1] in SUFFIX_ABBREVS:
+        tokens = tokens[:-1]
+    return ' '.join(tokens)
+
+
+def suffix_of(street):
+    tokens = street.split()
+    return tokens[-1] if len(tokens) > 1 and tokens[-1] in SUFFIX_ABBREVS else None
+
+
+class Street:
+    """Known house numbers and coordinates along one street."""
+
+    def __init__(self, name, numbers, lat, lon):
+        order = np.argsort(numbers, kind='stable')
+        self.name = name
+        self.numbers = np.asarray(numbers, dtype=float)[order]
+        self.lat = np.asarray(lat, dtype=float)[order]
+        self.lon = np.asarray(lon, dtype=float)[order]
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def interpolate(self, number):
+        """Return (lat, lon, confidence) for a house number on this street."""
+        nums = self.numbers
+        if len(nums) == 0:
+            return None
+        exact = np.flatnonzero(nums == number)
+        if len(exact):
+            return self.lat[exact].mean(), self.lon[exact].mean(), 1.0
+        if len(np.unique(nums)) < 2:
+            return None
+        if nums[0] <= number <= nums[-1]:
+            i = np.searchsorted(nums, number)
+            gap = nums[i] - nums[i - 1]
+            conf = 0.95 if gap <= MAX_GAP else 0.6
+            return np.interp(number, nums, self.lat), np.interp(number, nums, self.lon), conf
+        # Extrapolate from the two nearest distinct numbers at the near end
+        uniq, idx = np.unique(nums, return_index=True)
+        ends = idx[:2] if number < nums[0] else idx[-2:]
+        n0, n1 = nums[ends]
+        frac = (number - n0) / (n1 - n0)
+        lat = self.lat[ends[0]] + frac * (self.lat[ends[1]] - self.lat[ends[0]])
+        lon = self.lon[ends[0]] + frac * (self.lon[ends[1]] - self.lon[ends[0]])
+        overshoot = min(abs(number - nums[0]), abs(number - nums[-1]))
+        return lat, lon, 0.7 if overshoot <= 100 else 0.3
+
+
+class LocalResolver:
+    """Resolve addresses from a gazetteer of already-geocoded points."""
+
+    def __init__(self, points):
+        """points: frame with address, lat, lon of trusted geocodes."""
+        rows = []
+        for addr, lat, lon in zip(points['address'], points['lat'], points['lon']):
+            m = NUMBER_RE.match(canonical_street(split_address(addr)[0]))
+            if m and pd.notnull(lat) and pd.notnull(lon):
+                rows.append((m.group(2), int(m.group(1)), lat, lon))
+        gaz = pd.DataFrame(rows, columns=['street', 'number', 'lat', 'lon'])
+        self.streets = {
+            name: Street(name, g['number'].values, g['lat'].values, g['lon'].values)
+            for name, g in gaz.groupby('street')
+        }
+        self.by_base = {}
+        for name in self.streets:
+            self.by_base.setdefault(base_name(name), []).append(name)
+        if len(gaz):
+            self.lat0, self.lon0 = gaz['lat'].mean(), gaz['lon'].mean()
+        else:
+            self.lat0 = self.lon0 = 0.0
+        logging.info(f'Local resolver: {len(self.streets)} streets from {len(gaz)} geocoded points')
+
+    @classmethod
+    def from_cache(cls, cache):
+        """Build from network-geocoded hits in a GeocodeCache."""
+        return cls(cache.hits(exclude_backends=('local',)))
+
+    def _xy(self, lat, lon):
+        x = (np.asarray(lon) - self.lon0) * M_PER_DEG_LON * np.cos(np.radians(self.lat0))
+        y = (np.asarray(lat) - self.lat0) * M_PER_DEG_LAT
+        return x, y
+
+    def _latlon(self, x, y):
+        lat = self.lat0 + y / M_PER_DEG_LAT
+        lon = self.lon0 + x / (M_PER_DEG_LON * np.cos(np.radians(self.lat0)))
+        return lat, lon
+
+    def find_street(self, street):
+        """Known street for a (possibly suffix-less) name, if unambiguous."""
+        if street in self.streets:
+            return self.streets[street]
+        names = self._candidates(street)
+        return self.streets[names[0]] if len(names) == 1 else None
+
+    def _candidates(self, street):
+        names = self.by_base.get(base_name(street), [])
+        suffix = suffix_of(street)
+        if suffix:
+            names = [n for n in names if suffix_of(n) in (suffix, None)]
+        tokens = street.split()
+        if len(tokens) > 1 and tokens[0] in DIRECTIONAL_ABBREVS:
+            names = [n for n in names if n.split()[0] == tokens[0] or n.split()[0] not in DIRECTIONAL_ABBREVS]
+        return names
+
+    def _line(self, street):
+        """Fit a line to every known point of a street, all directional halves included.
+
+        Returns (centroid, unit direction, (tmin, tmax), rms, npoints) in local metres.
+        """
+        names = self.by_base.get(base_name(street), [])
+        suffix = suffix_of(street)
+        if suffix:
+            names = [n for n in names if suffix_of(n) in (suffix, None)]
+        if not names:
+            return None
+        lat = np.concatenate([self.streets[n].lat for n in names])
+        lon = np.concatenate([self.streets[n].lon for n in names])
+        x, y = self._xy(lat, lon)
+        pts = np.column_stack([x, y])
+        pts = np.unique(np.round(pts, 1), axis=0)
+        if len(pts) < 2:
+            return None
+        centroid = pts.mean(axis=0)
+        _, s, vt = np.linalg.svd(pts - centroid, full_matrices=False)
+        direction = vt[0]
+        along = (pts - centroid) @ direction
+        rms = s[1] / np.sqrt(len(pts)) if len(s) > 1 else 0.0
+        return centroid, direction, (along.min(), along.max()), rms, len(pts)
+
+    def intersect(self, a, b):
+        """Return (lat, lon, confidence) where streets a and b cross."""
+        la, lb = self._line(a), self._line(b)
+        if la is None or lb is None:
+            return None
+        (c1, d1, ext1, rms1, n1), (c2, d2, ext2, rms2, n2) = la, lb
+        cross = d1[0] * d2[1] - d1[1] * d2[0]
+        if abs(cross) < MIN_ANGLE:
+            return None
+        diff = c2 - c1
+        t1 = (diff[0] * d2[1] - diff[1] * d2[0]) / cross
+        t2 = (diff[0] * d1[1] - diff[1] * d1[0]) / cross
+        point = c1 + t1 * d1
+        conf = 0.9 if min(n1, n2) >= 3 else 0.75
+        outside = max(ext1[0] - t1, t1 - ext1[1], ext2[0] - t2, t2 - ext2[1], 0)
+        if outside > EXTENT_MARGIN:
+            conf = 0.3
+        elif outside > 0:
+            conf -= 0.1
+        if max(rms1, rms2) > MAX_RMS:
+            conf *= 0.6
+        lat, lon = self._latlon(point[0], point[1])
+        return float(lat), float(lon), conf
+
+    def resolve(self, addr):
+        """Resolve addr offline.
+
+        Returns a dict with lat, lon, confidence and the query that was
+        answered, or None if the gazetteer knows nothing useful.
+        """
+        street, _ = split_address(addr)
+        parts = [canonical_street(p) for p in INTERSECTION_RE.split(street.upper()) if p.strip()]
+        street = canonical_street(street)
+        if len(parts) == 2:
+            hit = self.intersect(parts[0], parts[1])
+            query = f'{parts[0]} & {parts[1]}'
+        else:
+            m = NUMBER_RE.match(street)
+            found = self.find_street(m.group(2)) if m else None
+            hit = found.interpolate(int(m.group(1))) if found else None
+            query = f'{m.group(1)} {found.name}' if found else street
+        if not hit:
+            return None
+        lat, lon, conf = hit
+        return {'lat': float(lat), 'lon': float(lon), 'confidence': round(float(conf), 3), 'query': query}
+
+    def suggest(self, addr):
+        """Network queries worth trying for addr, using known street suffixes.
+
+        For '239 WAYNE' this is ['239 WAYNE AVE'], replacing a blind walk
+        through every street type.
+        """
+        street, locality = split_address(addr)
+        m = NUMBER_RE.match(canonical_street(street))
+        if not m or suffix_of(m.group(2)):
+            return []
+        names = self._candidates(m.group(2))
+        tail = f', {locality}' if locality else ''
+        return [f'{m.group(1)} {n}{tail}' for n in names if n != m.group(2)]
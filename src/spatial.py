@@ -0,0 +1,291 @@
+"""
+Spatial hotspot engine for Alameda Police Data.
+
+Geocoded incidents are counted on a fixed square grid (CELL_M metres,
+anchored at lat/lon 0 so bins from different runs or chunks line up),
+split by nature group, year and month. Everything downstream works on
+those sparse bin counts, never on raw rows:
+
+- smooth() spreads each occupied cell over its neighbours with a
+  truncated separable Gaussian kernel, so its cost follows the number
+  of occupied cells, not the extent they span;
+- density() rasterises that sparse surface for plotting, clipped to at
+  most MAX_SURFACE_SIDE cells a side;
+- HotspotIndex.top() returns the strongest density peaks for a group
+  and time window;
+- HotspotIndex.change() compares the density of two periods.
+
+Bins are mergeable (merge_bins), so the streaming build bins chunk by
+chunk and memory is bounded by the number of occupied cells.
+"""
+
+import json
+import logging
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+BINS_PATH = Path('data/spatial_bins.parquet')
+CELL_M = 100.0
+BANDWIDTH_M = 150.0
+REF_LAT = 42.87  # latitude the east-west cell width is computed at (Pocatello)
+BIN_KEYS = ['nature_grp', 'year', 'month']
+MAX_SURFACE_SIDE = 1000  # cells; 100 km at the default cell size
+M_PER_DEG_LAT = 110540.0
+M_PER_DEG_LON = 111320.0
+
+
+class Grid:
+    """Square grid of cell_m metres, anchored at lat/lon 0."""
+
+    def __init__(self, cell_m=CELL_M, ref_lat=REF_LAT):
+        self.cell_m = float(cell_m)
+        self.ref_lat = float(ref_lat)
+        self.dlat = self.cell_m / M_PER_DEG_LAT
+        self.dlon = self.cell_m / (M_PER_DEG_LON * np.cos(np.radians(self.ref_lat)))
+
+    def to_cells(self, lat, lon):
+        """Cell indices (ix, iy) for coordinate arrays."""
+        ix = np.floor(np.asarray(lon, dtype=float) / self.dlon).astype('int32')
+        iy = np.floor(np.asarray(lat, dtype=float) / self.dlat).astype('int32')
+        return ix, iy
+
+    def centers(self, ix, iy):
+        """Cell-center (lat, lon) for index arrays."""
+        return (np.asarray(iy) + 0.5) * self.dlat, (np.asarray(ix) + 0.5) * self.dlon
+
+    def to_dict(self):
+        return {'cell_m': self.cell_m, 'ref_lat': self.ref_lat}
+
+
+def bin_incidents(df, grid=None, keys=BIN_KEYS):
+    """Count geocoded incidents per grid cell and key combination."""
+    grid = grid or Grid()
+    df = df[df['lat'].notna() & df['lon'].notna()]
+    if df.empty:
+        return pd.DataFrame(columns=list(keys) + ['ix', 'iy', 'incidents'])
+    ix, iy = grid.to_cells(df['lat'].to_numpy(), df['lon'].to_numpy())
+    cells = df[list(keys)].assign(ix=ix, iy=iy)
+    bins = cells.groupby(list(keys) + ['ix', 'iy'], observed=True).size().rename('incidents').reset_index()
+    bins['incidents'] = bins['incidents'].astype('int32')
+    return bins
+
+
+def merge_bins(*frames, keys=BIN_KEYS):
+    """Add up bin frames built on the same grid (None frames are skipped)."""
+    frames = [f for f in frames if f is not None and len(f)]
+    if not frames:
+        return pd.DataFrame(columns=list(keys) + ['ix', 'iy', 'incidents'])
+    merged = pd.concat(frames, ignore_index=True)
+    merged = merged.groupby(list(keys) + ['ix', 'iy'], observed=True)['incidents'].sum().reset_index()
+    merged['incidents'] = merged['incidents'].astype('int32')
+    return merged
+
+
+def write_bins(bins, grid, path=BINS_PATH):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    table = pa.Table.from_pandas(bins, preserve_index=False)
+    meta = dict(table.schema.metadata or {})
+    meta[b'grid'] = json.dumps(grid.to_dict()).encode()
+    pq.write_table(table.replace_schema_metadata(meta), path)
+    logging.info(f'Wrote {len(bins):,} spatial bins to {path}')
+
+
+def read_bins(path=BINS_PATH):
+    """Return (bins, grid) from a file written by write_bins."""
+    table = pq.read_table(path)
+    grid = Grid(**json.loads(table.schema.metadata[b'grid']))
+    return table.to_pandas(), grid
+
+
+def _cell_keys(ix, iy):
+    """One int64 per (ix, iy) cell."""
+    return (np.asarray(ix, dtype='int64') << 32) | (np.asarray(iy, dtype='int64') & 0xFFFFFFFF)
+
+
+def _spread(ix, iy, weights, offsets, kernel, along_x):
+    """Spread cell weights along one axis and add up the cells they land on."""
+    if along_x:
+        ix, iy = (ix[:, None] + offsets).ravel(), np.repeat(iy, len(offsets))
+    else:
+        ix, iy = np.repeat(ix, len(offsets)), (iy[:, None] + offsets).ravel()
+    keys, inverse = np.unique(_cell_keys(ix, iy), return_inverse=True)
+    sums = np.bincount(inverse, weights=(weights[:, None] * kernel).ravel())
+    return (keys >> 32).astype('int64'), (keys & 0xFFFFFFFF).astype('uint32').astype('int32').astype('int64'), sums
+
+
+def smooth(bins, grid, bandwidth_m=BANDWIDTH_M, pad=3):
+    """Sparse Gaussian kernel density of the bins' incident counts.
+
+    The kernel is cut off pad bandwidths from its centre and normalised,
+    so the total is the incident count and only cells that close to an
+    occupied one are returned, as a frame of ix, iy and density.
+    """
+    if bins.empty:
+        return pd.DataFrame({'ix': np.zeros(0, 'int64'), 'iy': np.zeros(0, 'int64'), 'density': np.zeros(0)})
+    cells = bins.groupby(['ix', 'iy'])['incidents'].sum()
+    sigma = max(bandwidth_m / grid.cell_m, 1e-6)
+    offsets = np.arange(-int(np.ceil(pad * sigma)), int(np.ceil(pad * sigma)) + 1)
+    kernel = np.exp(-0.5 * (offsets / sigma) ** 2)
+    kernel /= kernel.sum()
+    ix = cells.index.get_level_values('ix').to_numpy(dtype='int64')
+    iy = cells.index.get_level_values('iy').to_numpy(dtype='int64')
+    # Separable: spread along x, then spread the result along y
+    ix, iy, values = _spread(ix, iy, cells.to_numpy(dtype=float), offsets, kernel, along_x=True)
+    ix, iy, values = _spread(ix, iy, values, offsets, kernel, along_x=False)
+    return pd.DataFrame({'ix': ix, 'iy': iy, 'density': values})
+
+
+def _busiest_window(cells, weights, side):
+    """Start of the side-cell interval holding the most weight."""
+    order = np.argsort(cells, kind='stable')
+    cells, total = cells[order], np.concatenate([[0.0], np.cumsum(weights[order])])
+    ends = np.searchsorted(cells, cells + side)
+    best = int(np.argmax(total[ends] - total[:len(cells)]))
+    return int(cells[best])
+
+
+def density(bins, grid, bandwidth_m=BANDWIDTH_M, pad=3, max_side=MAX_SURFACE_SIDE):
+    """Gaussian kernel density surface of the bins' incident counts.
+
+    Returns (surface, ix0, iy0) where surface[row, col] is the smoothed
+    incident count of cell (ix0 + col, iy0 + row). Along an axis where
+    the smoothed cells span more than max_side cells (a stray geocode
+    far out of town), the surface is clipped to the max_side window
+    holding the most incidents.
+    """
+    cells = smooth(bins, grid, bandwidth_m, pad)
+    if cells.empty:
+        return np.zeros((0, 0)), 0, 0
+    ix, iy, values = cells['ix'].to_numpy(), cells['iy'].to_numpy(), cells['density'].to_numpy()
+    window = []
+    for axis in (ix, iy):
+        lo, hi = int(axis.min()), int(axis.max())
+        if hi - lo + 1 > max_side:
+            lo = _busiest_window(axis, values, max_side)
+            hi = lo + max_side - 1
+            logging.info(f'Clipped density surface from {int(axis.max()) - int(axis.min()) + 1} to {max_side} cells')
+        window.append((lo, hi))
+    (ix0, ix1), (iy0, iy1) = window
+    inside = (ix >= ix0) & (ix <= ix1) & (iy >= iy0) & (iy <= iy1)
+    surface = np.zeros((iy1 - iy0 + 1, ix1 - ix0 + 1))
+    surface[iy[inside] - iy0, ix[inside] - ix0] = values[inside]
+    return surface, ix0, iy0
+
+
+def surface_extent(surface, ix0, iy0, grid):
+    """(lon_min, lon_max, lat_min, lat_max) covered by a density() surface."""
+    ny, nx = surface.shape
+    return ix0 * grid.dlon, (ix0 + nx) * grid.dlon, iy0 * grid.dlat, (iy0 + ny) * grid.dlat
+
+
+def _local_maxima(ix, iy, values):
+    """Cells with a positive value at least as large as each of their 8 neighbours (absent cells are 0)."""
+    index = pd.Index(_cell_keys(ix, iy))
+    peaks = values > 0
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            if dx or dy:
+                pos = index.get_indexer(_cell_keys(ix + dx, iy + dy))
+                peaks &= values >= np.where(pos >= 0, values[pos], 0.0)
+    return peaks
+
+
+def find_peaks(cells, grid, n=10, bandwidth_m=BANDWIDTH_M):
+    """The n strongest local maxima of the density of cells, strongest first."""
+    surface = smooth(cells, grid, bandwidth_m)
+    if surface.empty:
+        return pd.DataFrame(columns=['lat', 'lon', 'density', 'incidents'])
+    ix, iy, values = surface['ix'].to_numpy(), surface['iy'].to_numpy(), surface['density'].to_numpy()
+    top = np.flatnonzero(_local_maxima(ix, iy, values))
+    top = top[np.argsort(-values[top], kind='stable')[:n]]
+    ix, iy = ix[top], iy[top]
+    lat, lon = grid.centers(ix, iy)
+    raw = cells.groupby(['ix', 'iy'])['incidents'].sum()
+    incidents = raw.reindex(pd.MultiIndex.from_arrays([ix, iy])).fillna(0).astype(int).to_numpy()
+    return pd.DataFrame({'lat': lat, 'lon': lon, 'density': values[top], 'incidents': incidents})
+
+
+def _period_index(value, end=False):
+    """Months since year 0 for 'YYYY', 'YYYY-MM', (year, month) or a timestamp."""
+    if value is None:
+        return None
+    if isinstance(value, (tuple, list)):
+        year, month = value
+    elif isinstance(value, (int, np.integer)):
+        year, month = int(value), 12 if end else 1
+    else:
+        text = str(value)
+        if len(text) == 4 and text.isdigit():
+            year, month = int(text), 12 if end else 1
+        else:
+            ts = pd.Timestamp(value)
+            year, month = ts.year, ts.month
+    return int(year) * 12 + int(month) - 1
+
+
+class HotspotIndex:
+    """Hotspot queries over persisted spatial bins."""
+
+    def __init__(self, bins, grid):
+        self.bins = bins
+        self.grid = grid
+        self._period = bins['year'].astype('int32').to_numpy() * 12 + bins['month'].astype('int32').to_numpy() - 1
+
+    @classmethod
+    def from_frame(cls, df, grid=None):
+        grid = grid or Grid()
+        return cls(bin_incidents(df, grid), grid)
+
+    @classmethod
+    def load(cls, path=BINS_PATH):
+        return cls(*read_bins(path))
+
+    def save(self, path=BINS_PATH):
+        write_bins(self.bins, self.grid, path)
+
+    def select(self, groups=None, start=None, end=None):
+        """Bins for the given nature groups and inclusive time window."""
+        mask = np.ones(len(self.bins), dtype=bool)
+        if groups is not None:
+            mask &= self.bins['nature_grp'].isin(list(groups)).to_numpy()
+        lo, hi = _period_index(start), _period_index(end, end=True)
+        if lo is not None:
+            mask &= self._period >= lo
+        if hi is not None:
+            mask &= self._period <= hi
+        sel = self.bins[mask]
+        return sel.groupby(['ix', 'iy'])['incidents'].sum().reset_index()
+
+    def surface(self, groups=None, start=None, end=None, bandwidth_m=BANDWIDTH_M):
+        """Density surface and its (lon_min, lon_max, lat_min, lat_max) extent."""
+        surface, ix0, iy0 = density(self.select(groups, start, end), self.grid, bandwidth_m)
+        return surface, surface_extent(surface, ix0, iy0, self.grid)
+
+    def top(self, n=10, groups=None, start=None, end=None, bandwidth_m=BANDWIDTH_M):
+        """The n strongest local density peaks, strongest first."""
+        return find_peaks(self.select(groups, start, end), self.grid, n, bandwidth_m)
+
+    def change(self, before, after, groups=None, n=10, bandwidth_m=BANDWIDTH_M):
+        """Strongest changes in hotspot density between two periods.
+
+        before and after are (start, end) windows. The smoothed surfaces
+        of the two periods are differenced, so incidents moving to a
+        neighbouring cell do not show up as a paired increase and
+        decrease; the n strongest local increases and n strongest local
+        decreases of that difference are returned.
+        """
+        a = smooth(self.select(groups, *before), self.grid, bandwidth_m).set_index(['ix', 'iy'])['density']
+        b = smooth(self.select(groups, *after), self.grid, bandwidth_m).set_index(['ix', 'iy'])['density']
+        both = pd.concat([a.rename('before'), b.rename('after')], axis=1).fillna(0.0)
+        both['change'] = both['after'] - both['before']
+        ix = both.index.get_level_values(0).to_numpy(dtype='int64')
+        iy = both.index.get_level_values(1).to_numpy(dtype='int64')
+        change = both['change'].to_numpy()
+        up = both[_local_maxima(ix, iy, change)].sort_values('change', ascending=False, kind='stable').head(n)
+        down = both[_local_maxima(ix, iy, -change)].sort_values('change', kind='stable').head(n)
+        picked = pd.concat([up, down.iloc[::-1]]).reset_index()
+        picked['lat'], picked['lon'] = self.grid.centers(picked['ix'].to_numpy(), picked['iy'].to_numpy())
+        return picked[['lat', 'lon', 'before', 'after', 'change']]
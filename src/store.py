@@ -0,0 +1,157 @@
+"""
+Columnar incident store for Alameda Police Data.
+
+Cleaned, geocoded incidents are written as a Parquet dataset partitioned
+by year (data/incidents/year=2024/...). Columns are typed once at build
+time: categorical codes, small integer date parts and float32
+coordinates. Readers get them back without re-parsing text. Reads
+support column projection and push year / nature group predicates down
+to the files, so a dashboard tab only touches what it needs.
+
+A rebuild writes the new dataset next to the store and swaps it in when
+complete, so readers see the old store or the new one, never a partial
+one.
+"""
+
+import shutil
+import logging
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+STORE_DIR = Path('data/incidents')
+LEGACY_CSV = Path('data/clean_incidents.csv')
+
+COLUMNS = ['incident_id', 'nature', 'area', 'agency', 'reported_dt_raw', 'address', 'reported_dt',
+           'year', 'month', 'day', 'hour', 'dow', 'nature_grp', 'address_id', 'lat', 'lon']
+CATEGORICAL = ['nature', 'nature_grp', 'area', 'agency', 'address']
+DTYPES = {
+    'year': 'int16', 'month': 'int8', 'day': 'int8', 'hour': 'int8', 'dow': 'int8',
+    'address_id': 'int32', 'lat': 'float32', 'lon': 'float32',
+}
+PARTITIONING = ds.partitioning(pa.schema([('year', pa.int16())]), flavor='hive')
+
+
+def to_typed(df):
+    """Return df with the store's column types."""
+    df = df.copy()
+    for col in CATEGORICAL:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    for col, dtype in DTYPES.items():
+        if col in df.columns:
+            df[col] = df[col].astype(dtype)
+    for col in ('incident_id', 'reported_dt_raw'):
+        if col in df.columns:
+            df[col] = df[col].astype(str)
+    if 'reported_dt' in df.columns:
+        df['reported_dt'] = pd.to_datetime(df['reported_dt'])
+    return df
+
+
+def _staging_dir(root):
+    """Empty sibling directory a new store is written to before it replaces root."""
+    tmp = root.with_name(root.name + '.tmp')
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    return tmp
+
+
+def _swap_in(tmp, root):
+    """Move a finished store from tmp to root, replacing what was there."""
+    old = root.with_name(root.name + '.old')
+    if old.exists():
+        shutil.rmtree(old)
+    if root.exists():
+        root.rename(old)
+    tmp.rename(root)
+    if old.exists():
+        shutil.rmtree(old)
+
+
+def write_incidents(df, root=STORE_DIR):
+    """Replace the store at root with df, one partition per year."""
+    root = Path(root)
+    tmp = _staging_dir(root)
+    table = pa.Table.from_pandas(to_typed(df), preserve_index=False)
+    ds.write_dataset(table, tmp, format='parquet', partitioning=PARTITIONING)
+    _swap_in(tmp, root)
+    logging.info(f'Wrote {len(df):,} incidents to {root}')
+
+
+class IncidentWriter:
+    """Write the store one chunk at a time, replacing any existing store.
+
+    Each chunk lands in its own files under the year partitions, so only
+    one chunk is held in memory. Categorical columns are written with
+    int32 dictionary indices so every file shares one schema; readers
+    unify the per-file dictionaries. Chunks go to a staging directory
+    that replaces the store on close().
+    """
+
+    def __init__(self, root=STORE_DIR):
+        self.root = Path(root)
+        self.tmp = _staging_dir(self.root)
+        self.tmp.mkdir(parents=True)
+        self.chunks = 0
+        self.rows = 0
+
+    def write(self, df):
+        table = pa.Table.from_pandas(to_typed(df), preserve_index=False)
+        schema = pa.schema([pa.field(f.name, pa.dictionary(pa.int32(), pa.string()))
+                            if pa.types.is_dictionary(f.type) else f for f in table.schema])
+        ds.write_dataset(table.cast(schema), self.tmp, format='parquet', partitioning=PARTITIONING,
+                         basename_template=f'chunk-{self.chunks:05d}-{{i}}.parquet',
+                         existing_data_behavior='overwrite_or_ignore')
+        self.chunks += 1
+        self.rows += len(df)
+
+    def close(self):
+        _swap_in(self.tmp, self.root)
+        logging.info(f'Wrote {self.rows:,} incidents to {self.root} in {self.chunks} chunks')
+
+
+def _filter(years=None, groups=None):
+    expr = None
+    for field, values in (('year', years), ('nature_grp', groups)):
+        if values is None:
+            continue
+        cond = ds.field(field).isin(list(values))
+        expr = cond if expr is None else expr & cond
+    return expr
+
+
+def read_incidents(root=STORE_DIR, columns=None, years=None, groups=None, csv_fallback=LEGACY_CSV):
+    """Read incidents from the store.
+
+    columns projects the read; years and groups (nature_grp values) are
+    pushed down as predicates. If the store has not been built yet the
+    legacy CSV export is read and typed instead.
+    """
+    root = Path(root)
+    if not root.exists():
+        if csv_fallback is None or not Path(csv_fallback).exists():
+            raise FileNotFoundError(f'No incident store at {root}')
+        logging.warning(f'No incident store at {root}; reading {csv_fallback}')
+        df = to_typed(pd.read_csv(csv_fallback))
+        if years is not None:
+            df = df[df['year'].isin(list(years))]
+        if groups is not None:
+            df = df[df['nature_grp'].isin(list(groups))]
+        return df[columns].reset_index(drop=True) if columns else df.reset_index(drop=True)
+    dataset = ds.dataset(root, format='parquet', partitioning=PARTITIONING)
+    table = dataset.to_table(columns=columns, filter=_filter(years, groups))
+    df = table.to_pandas()
+    order = columns or [c for c in COLUMNS if c in df.columns] + [c for c in df.columns if c not in COLUMNS]
+    return df[order]
+
+
+def store_mtime(root=STORE_DIR, csv_fallback=LEGACY_CSV):
+    """Latest modification time of the store's files (for cache keys)."""
+    root = Path(root)
+    if root.exists():
+        return max((p.stat().st_mtime for p in root.rglob('*.parquet')), default=0.0)
+    if csv_fallback is not None and Path(csv_fallback).exists():
+        return Path(csv_fallback).stat().st_mtime
+    return 0.0
@@ -0,0 +1,188 @@
+"""
+Streaming build for Alameda Police Data.
+
+stream_incidents() reads the raw workbooks in fixed-size row chunks and
+takes each chunk through cleaning, nature recoding and the geocode join,
+writes it to the incident store and folds it into StreamAggregates. Only
+one chunk of rows is in memory at a time; everything kept across chunks
+is an aggregate whose size depends on the number of distinct values
+(cube cells, grid cells, locations, addresses), not on the number of
+incidents:
+
+- the count cube (cube.merge_cubes);
+- spatial bins for the hotspot index (spatial.merge_bins);
+- per-location counts and heat points for the heatmap
+  (maps.merge_location_counts, maps.merge_heat_points);
+- the most common addresses, from a SpaceSaving heavy-hitters sketch;
+- the first and last incident time, for the report summary.
+
+Every aggregate is mergeable, so aggregates built from separate chunks,
+workbooks or agencies add up with StreamAggregates.merge().
+"""
+
+import logging
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from address import encode_addresses
+from cube import build_cube, merge_cubes
+from etl import clean_frame, iter_workbook
+from geocode import LOCAL_CONFIDENCE, geocode_addresses, write_intersections
+from maps import heat_points, layers_from_counts, location_counts, merge_heat_points, merge_location_counts
+from metrics import count, measure
+from nature import DEFAULT_RULES, recode_nature
+from resolver import LocalResolver
+from spatial import Grid, HotspotIndex, bin_incidents, merge_bins
+from summary import TOP_ADDRESSES, build_summary
+
+CHUNK_ROWS = 100_000
+TOP_K = 1000  # counters kept by the address sketch
+
+
+class SpaceSaving:
+    """Space-Saving heavy-hitters sketch holding at most k counters.
+
+    Every item's true count lies in [count - error, count]; items whose
+    true count exceeds total / k are always kept. Sketches merge by
+    adding counters, charging items missing from one side that side's
+    smallest counter (Agarwal et al., Mergeable Summaries).
+    """
+
+    def __init__(self, k=TOP_K):
+        self.k = k
+        self.counts = pd.Series(dtype='int64')
+        self.errors = pd.Series(dtype='int64')
+        self.floor = 0  # largest count an item missing from the sketch can have
+
+    def update(self, values):
+        """Add the items of a Series (one per occurrence)."""
+        exact = SpaceSaving(self.k)
+        exact.counts = values.value_counts().astype('int64')
+        exact.errors = pd.Series(0, index=exact.counts.index, dtype='int64')
+        self.merge(exact)
+
+    def merge(self, other):
+        items = self.counts.index.union(other.counts.index)
+        mine, theirs = self.floor, other.floor
+        self.counts = (self.counts.reindex(items, fill_value=mine)
+                       + other.counts.reindex(items, fill_value=theirs)).astype('int64')
+        self.errors = (self.errors.reindex(items, fill_value=mine)
+                       + other.errors.reindex(items, fill_value=theirs)).astype('int64')
+        self.floor = mine + theirs
+        if len(self.counts) > self.k:
+            keep = self.counts.sort_values(ascending=False, kind='stable').index[:self.k]
+            self.counts, self.errors = self.counts[keep], self.errors[keep]
+            self.floor = int(self.counts.min())
+
+    def top(self, n=10):
+        """The n largest counters, largest first."""
+        return self.counts.sort_values(ascending=False, kind='stable').head(n)
+
+
+class StreamAggregates:
+    """Mergeable aggregates of a stream of cleaned, geocoded chunks."""
+
+    def __init__(self, grid=None, top_k=TOP_K):
+        self.rows = 0
+        self.grid = grid or Grid()
+        self.cube = None
+        self.bins = None
+        self.addresses = SpaceSaving(top_k)
+        self.locations = None
+        self.heat = None
+        self.first = None
+        self.last = None
+
+    def _span(self, first, last):
+        self.first = first if self.first is None else min(self.first, first)
+        self.last = last if self.last is None else max(self.last, last)
+
+    def update(self, df):
+        """Fold one chunk of incidents into the aggregates."""
+        self.rows += len(df)
+        self._span(df['reported_dt'].min(), df['reported_dt'].max())
+        self.cube = merge_cubes(self.cube, build_cube(df))
+        self.bins = merge_bins(self.bins, bin_incidents(df, self.grid))
+        self.addresses.update(df['address'].astype(str))
+        self.locations = merge_location_counts(self.locations, location_counts(df))
+        self.heat = merge_heat_points(self.heat, heat_points(df))
+
+    def merge(self, other):
+        """Add another StreamAggregates built on the same grid."""
+        if other.rows == 0:
+            return
+        self.cube = merge_cubes(self.cube, other.cube)
+        self.bins = merge_bins(self.bins, other.bins)
+        self.locations = merge_location_counts(self.locations, other.locations)
+        self.heat = merge_heat_points(self.heat, other.heat)
+        self.addresses.merge(other.addresses)
+        self._span(other.first, other.last)
+        self.rows += other.rows
+
+    def hotspots(self):
+        return HotspotIndex(merge_bins(self.bins), self.grid)
+
+    def layers(self):
+        """Heatmap layers (see maps.layers_from_counts)."""
+        if self.locations is None:
+            return pd.DataFrame(), pd.DataFrame(columns=['lat', 'lon', 'weight']), None
+        return layers_from_counts(self.locations, self.heat)
+
+    def top_addresses(self, n=10):
+        """Most common addresses, shaped like df['address'].value_counts()."""
+        return self.addresses.top(n).rename_axis('address').rename('count')
+
+    def summary(self):
+        """Report summary (see summary.py)."""
+        return build_summary(self.cube, self.top_addresses(TOP_ADDRESSES), self.first, self.last)
+
+
+def iter_chunks(files, chunk_rows=CHUNK_ROWS, nature_rules=DEFAULT_RULES):
+    """Cleaned, nature-recoded chunks of at most chunk_rows raw rows."""
+    for path in files:
+        for n, raw in enumerate(iter_workbook(path, chunk_rows)):
+            with measure(f'stream.clean[{Path(path).name}#{n}]', rows_in=len(raw)) as step:
+                df = clean_frame(raw)
+                df['nature_grp'] = recode_nature(df['nature'], nature_rules)
+                step['rows_out'] = len(df)
+            if len(df):
+                yield df.reset_index(drop=True)
+
+
+def stream_incidents(files, cache, engine, chunk_rows=CHUNK_ROWS, writer=None, csv_path=None,
+                     nature_rules=DEFAULT_RULES, min_confidence=LOCAL_CONFIDENCE):
+    """Clean, geocode and aggregate raw workbooks one chunk at a time.
+
+    cache is an open GeocodeCache and engine a GeocodeEngine for misses.
+    Each geocoded chunk goes to writer (a store.IncidentWriter) and, with
+    csv_path, is appended to the tidy CSV export. address_id is assigned
+    in order of first appearance across all chunks. Skipped intersection
+    addresses from every chunk are written once at the end. Returns the
+    StreamAggregates of every incident.
+    """
+    aggregates = StreamAggregates()
+    address_ids = {}
+    intersections = []
+    resolver = LocalResolver.from_cache(cache)
+    if csv_path is not None:
+        Path(csv_path).unlink(missing_ok=True)
+    for df in iter_chunks(files, chunk_rows, nature_rules):
+        with measure('stream.geocode', rows_in=len(df)):
+            df = geocode_addresses(encode_addresses(df), cache, engine=engine, resolver=resolver,
+                                   min_confidence=min_confidence, intersections=intersections)
+        # Chunk-local address codes -> ids that are stable across chunks
+        ids = np.array([address_ids.setdefault(a, len(address_ids)) for a in df['address'].cat.categories],
+                       dtype='int32')
+        df['address_id'] = ids[df['address_id'].to_numpy()]
+        with measure('stream.write', rows_in=len(df)):
+            if writer is not None:
+                writer.write(df)
+            if csv_path is not None:
+                df.to_csv(csv_path, mode='a', header=not Path(csv_path).exists(), index=False)
+        with measure('stream.aggregate', rows_in=len(df)):
+            aggregates.update(df)
+        count('stream.chunks')
+        logging.info(f'Streamed {aggregates.rows:,} incidents ({len(address_ids):,} addresses)')
+    # The same intersection can be skipped in several chunks
+    write_intersections(list(dict.fromkeys(intersections)))
+    return aggregates
@@ -0,0 +1,116 @@
+"""
+Report summary for Alameda Police Data.
+
+Every headline number in the reports (totals, counts per year, month,
+day, hour, nature group, nature code and area, the most common
+addresses and year-over-year changes per nature group) is computed once
+per build by build_summary() and written to data/summary.json. The
+narrative and dump scripts, the static charts and the dashboard all
+read that file, so they agree with each other and none of them touch
+incident rows.
+
+Counts come from the count cube, so a summary is as cheap to build from
+streamed aggregates as from a full frame. The file carries
+SUMMARY_VERSION; a summary written by a different version is rebuilt
+from the incident store rather than trusted.
+"""
+
+import json
+import logging
+from pathlib import Path
+import pandas as pd
+from cube import build_cube
+from store import read_incidents
+
+SUMMARY_PATH = Path('data/summary.json')
+SUMMARY_VERSION = 1
+TOP_ADDRESSES = 10
+SUMMARY_COLUMNS = ['year', 'month', 'dow', 'hour', 'nature_grp', 'agency', 'area', 'nature', 'address', 'reported_dt']
+
+
+def _records(frame):
+    """JSON-ready records; NaN becomes null."""
+    return frame.astype(object).where(frame.notna(), None).to_dict('records')
+
+
+def _counts(cube, by, order='key'):
+    counts = cube.groupby(by, observed=True)['incidents'].sum()
+    if order == 'count':
+        counts = counts.sort_values(ascending=False, kind='stable')
+    return counts.reset_index()
+
+
+def year_over_year(by_year, by=None):
+    """Add change and pct_change against the previous year (per by group)."""
+    by_year = by_year.sort_values(([by] if by else []) + ['year']).reset_index(drop=True)
+    prev = by_year.groupby(by, observed=True)['incidents'].shift() if by else by_year['incidents'].shift()
+    # Only compare with the year directly before; a group absent that year gets no change
+    gap = by_year['year'] - (by_year.groupby(by, observed=True)['year'].shift() if by else by_year['year'].shift())
+    prev = prev.where(gap == 1)
+    by_year['change'] = (by_year['incidents'] - prev).astype('Int64')
+    by_year['pct_change'] = ((by_year['incidents'] - prev) / prev * 100).round(1)
+    return by_year
+
+
+def build_summary(cube, top_addresses, first_incident=None, last_incident=None):
+    """Summary dict from a count cube and a Series of top address counts."""
+    by_year = _counts(cube, 'year')
+    by_group_year = _counts(cube, ['nature_grp', 'year'])
+    by_month = cube.groupby('month')['incidents'].sum().reindex(range(1, 13), fill_value=0)
+    summary = {
+        'version': SUMMARY_VERSION,
+        'incidents': int(cube['incidents'].sum()),
+        'first_incident': str(first_incident) if first_incident is not None else None,
+        'last_incident': str(last_incident) if last_incident is not None else None,
+        'years': [int(by_year['year'].min()), int(by_year['year'].max())] if len(by_year) else None,
+        'by_year': _records(year_over_year(by_year)),
+        'by_month': _records(by_month.rename_axis('month').reset_index(name='incidents')),
+        'by_dow': _records(_counts(cube, 'dow')),
+        'by_hour': _records(_counts(cube, 'hour')),
+        'by_group': _records(_counts(cube, 'nature_grp', 'count')),
+        'by_nature': _records(_counts(cube, 'nature', 'count')),
+        'by_area': _records(_counts(cube, 'area', 'count')),
+        'by_agency': _records(_counts(cube, 'agency', 'count')),
+        'by_group_year': _records(year_over_year(by_group_year, 'nature_grp')),
+        'top_addresses': _records(top_addresses.head(TOP_ADDRESSES).rename_axis('address').reset_index(name='incidents')),
+    }
+    logging.info(f"Built report summary of {summary['incidents']:,} incidents")
+    return summary
+
+
+def summarize(df, cube=None):
+    """Summary of a frame of cleaned incidents (cube: its count cube, if already built)."""
+    cube = build_cube(df) if cube is None else cube
+    return build_summary(cube, df['address'].value_counts().head(TOP_ADDRESSES),
+                         df['reported_dt'].min(), df['reported_dt'].max())
+
+
+def write_summary(summary, path=SUMMARY_PATH):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.tmp')
+    tmp.write_text(json.dumps(summary, indent=2))
+    tmp.replace(path)
+    logging.info(f'Wrote report summary to {path}')
+
+
+def read_summary(path=SUMMARY_PATH):
+    """Summary written by write_summary(); ValueError if its version is stale."""
+    summary = json.loads(Path(path).read_text())
+    if summary.get('version') != SUMMARY_VERSION:
+        raise ValueError(f"{path} is summary version {summary.get('version')}, expected {SUMMARY_VERSION}")
+    return summary
+
+
+def load_summary(path=SUMMARY_PATH):
+    """The persisted summary, or one computed from the incident store if it is missing or stale."""
+    try:
+        return read_summary(path)
+    except (OSError, ValueError) as exc:
+        logging.warning(f'No current report summary ({exc}); computing it from the incident store')
+    return summarize(read_incidents(columns=SUMMARY_COLUMNS))
+
+
+def table(summary, name):
+    """One section of a summary as a DataFrame (e.g. table(s, 'by_year'))."""
+    return pd.DataFrame(summary[name])
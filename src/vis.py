@@ -1,211 +1,300 @@
 """
 Visualization builders for Alameda Police Data analytics.
+
+Each static chart is a ChartTask: a module-level render function, the
+small aggregate it plots and its plotting parameters. Chart aggregates
+come from the report summary, the count cube and the hotspot bins, so
+charts can be drawn from a full frame (build_charts) or from
+aggregates merged chunk by chunk (render_charts). Charts whose content
+hash matches the chart manifest are skipped and the rest render on a
+process pool.
 """
 
+import calendar
+import hashlib
+import inspect
+import json
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-import plotly.express as px
 import seaborn as sns
-import folium
-from folium.plugins import HeatMap
-import branca.colormap as cm
 import pandas as pd
 import numpy as np
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from cube import build_cube
+from maps import cached_layers_html, map_layers
+from metrics import METRICS, capture, count, measure
+import spatial
+from spatial import BANDWIDTH_M, Grid, HotspotIndex, density, find_peaks, surface_extent
+from summary import summarize, table
 
-def build_charts(df, charts_dir):
-    charts_dir = Path(charts_dir)
-    charts_dir.mkdir(parents=True, exist_ok=True)
-    import calendar
+CHART_MANIFEST = '.chart_manifest.json'
 
-    # 1. Incidents per year
-    yearly = df.groupby('year').size().reset_index(name='incidents')
+
+class ChartTask:
+    """One static chart: render(data, path, **params) writes filename.
+
+    deps lists the functions or modules outside render whose code also
+    shapes the chart (e.g. the spatial module for density maps).
+    """
+
+    def __init__(self, filename, render, data, deps=(), **params):
+        self.filename = filename
+        self.render = render
+        self.data = data
+        # Source text rather than the objects: tasks are pickled to worker processes
+        self.code = ''.join(inspect.getsource(obj) for obj in (render, *deps))
+        self.params = params
+
+    def key(self):
+        """Content hash of the chart's code, aggregated input and parameters."""
+        h = hashlib.sha256(repr((self.filename, sorted(self.params.items()))).encode())
+        h.update(self.code.encode())
+        names = list(self.data.columns) if isinstance(self.data, pd.DataFrame) else [self.data.name]
+        h.update(repr((names, list(self.data.index.names))).encode())
+        h.update(pd.util.hash_pandas_object(self.data).values.tobytes())
+        return h.hexdigest()[:16]
+
+
+def _render(task, charts_dir):
+    with measure(f'chart.render[{task.filename}]', rows_in=len(task.data)):
+        task.render(task.data, Path(charts_dir) / task.filename, **task.params)
+        plt.close('all')
+    return task.filename
+
+
+def plot_yearly(yearly, path):
     plt.figure(figsize=(7,4))
     plt.plot(yearly['year'], yearly['incidents'], marker='o')
     plt.title('Total Incidents per Year')
     plt.xlabel('Year')
     plt.ylabel('Incidents')
     plt.tight_layout()
-    plt.savefig(charts_dir/'yearly_trend.png')
+    plt.savefig(path)
     plt.close()
 
-    # 2. Incidents per month
-    if 'month' in df.columns:
-        monthly = df.groupby('month').size().reindex(range(1,13), fill_value=0).reset_index(name='incidents')
-        plt.figure(figsize=(7,4))
-        plt.plot(monthly['month'], monthly['incidents'], marker='o')
-        plt.title('Total Incidents per Month')
-        plt.xlabel('Month')
-        plt.ylabel('Incidents')
-        plt.xticks(ticks=range(1,13), labels=[calendar.month_abbr[m] for m in range(1,13)])
-        plt.tight_layout()
-        plt.savefig(charts_dir/'monthly_trend.png')
-        plt.close()
+def plot_monthly(monthly, path):
+    plt.figure(figsize=(7,4))
+    plt.plot(monthly['month'], monthly['incidents'], marker='o')
+    plt.title('Total Incidents per Month')
+    plt.xlabel('Month')
+    plt.ylabel('Incidents')
+    plt.xticks(ticks=range(1,13), labels=[calendar.month_abbr[m] for m in range(1,13)])
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
 
-    # 3. Incidents by day of week
-    if 'weekday' in df.columns or 'dayofweek' in df.columns or 'reported_dt' in df.columns:
-        if 'weekday' in df.columns:
-            days = df['weekday']
-        elif 'dayofweek' in df.columns:
-            days = df['dayofweek']
-        else:
-            days = pd.to_datetime(df['reported_dt']).dt.dayofweek
-        dow = pd.Series(days).value_counts().sort_index()
-        plt.figure(figsize=(7,4))
-        plt.bar(dow.index, dow.values)
-        plt.title('Incidents by Day of Week')
-        plt.xlabel('Day of Week')
-        plt.ylabel('Incidents')
-        plt.xticks(ticks=range(7), labels=['Mon','Tue','Wed','Thu','Fri','Sat','Sun'])
-        plt.tight_layout()
-        plt.savefig(charts_dir/'dow_bar.png')
-        plt.close()
+def plot_counts_bar(counts, path, title, xlabel, figsize, xticklabels=None):
+    plt.figure(figsize=figsize)
+    plt.bar(counts.index, counts.values)
+    plt.title(title)
+    plt.xlabel(xlabel)
+    plt.ylabel('Incidents')
+    if xticklabels:
+        plt.xticks(ticks=range(len(xticklabels)), labels=list(xticklabels))
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
 
-    # 4. Incidents by hour
-    if 'hour' in df.columns:
-        hour_counts = df['hour'].value_counts().sort_index()
-        plt.figure(figsize=(7,4))
-        plt.bar(hour_counts.index, hour_counts.values)
-        plt.title('Incidents by Hour of Day')
-        plt.xlabel('Hour')
-        plt.ylabel('Incidents')
-        plt.tight_layout()
-        plt.savefig(charts_dir/'hour_bar.png')
-        plt.close()
+def plot_series_bar(counts, path, title, xlabel, figsize):
+    plt.figure(figsize=figsize)
+    counts.plot.bar()
+    plt.title(title)
+    plt.xlabel(xlabel)
+    plt.ylabel('Incidents')
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
 
-    # 5. Incident type distribution (pie and bar)
-    if 'nature' in df.columns:
-        type_counts = df['nature'].value_counts().sort_values(ascending=False)
-        plt.figure(figsize=(7,7))
-        type_counts.plot.pie(autopct='%1.1f%%', startangle=90)
-        plt.title('Incident Type Distribution (Pie)')
-        plt.ylabel('')
-        plt.tight_layout()
-        plt.savefig(charts_dir/'type_pie.png')
-        plt.close()
-        plt.figure(figsize=(10,5))
-        type_counts.plot.bar()
-        plt.title('Incident Type Distribution (Bar)')
-        plt.xlabel('Type')
-        plt.ylabel('Incidents')
-        plt.tight_layout()
-        plt.savefig(charts_dir/'type_bar.png')
-        plt.close()
+def plot_type_pie(type_counts, path):
+    plt.figure(figsize=(7,7))
+    type_counts.plot.pie(autopct='%1.1f%%', startangle=90)
+    plt.title('Incident Type Distribution (Pie)')
+    plt.ylabel('')
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
 
-    # 6. Yearly trend by incident type (already present as stack)
-    stack = df.groupby(['year','nature_grp']).size().reset_index(name='count')
-    stack_pivot = stack.pivot(index='year', columns='nature_grp', values='count').fillna(0)
-    stack_pivot = stack_pivot.div(stack_pivot.sum(axis=1), axis=0)
+def plot_type_stack(stack_pivot, path):
     stack_pivot.plot.area(colormap='tab20', figsize=(8,5))
     plt.title('Incident Type Share per Year')
     plt.xlabel('Year')
     plt.ylabel('Proportion')
     plt.legend(title='Nature Group', bbox_to_anchor=(1.05,1), loc='upper left')
     plt.tight_layout()
-    plt.savefig(charts_dir/'type_stack.png')
+    plt.savefig(path)
     plt.close()
 
-    # 7. Incident type by month (heatmap)
-    if 'month' in df.columns and 'nature_grp' in df.columns:
-        month_type = df.groupby(['month','nature_grp']).size().unstack(fill_value=0)
-        plt.figure(figsize=(10,6))
-        sns.heatmap(month_type, cmap='YlGnBu', cbar_kws={'label':'Incidents'})
-        plt.title('Incident Type by Month')
-        plt.xlabel('Nature Group')
-        plt.ylabel('Month')
-        plt.yticks(ticks=np.arange(12)+0.5, labels=[calendar.month_abbr[m] for m in range(1,13)], rotation=0)
-        plt.tight_layout()
-        plt.savefig(charts_dir/'type_by_month_heat.png')
-        plt.close()
+def plot_type_by_month(month_type, path):
+    plt.figure(figsize=(10,6))
+    sns.heatmap(month_type, cmap='YlGnBu', cbar_kws={'label':'Incidents'})
+    plt.title('Incident Type by Month')
+    plt.xlabel('Nature Group')
+    plt.ylabel('Month')
+    plt.yticks(ticks=np.arange(12)+0.5, labels=[calendar.month_abbr[m] for m in range(1,13)], rotation=0)
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
 
-    # 8. Seasonality heatmap (hour x month) (already present)
-    heat = df.groupby(['hour','month']).size().unstack(fill_value=0)
+def plot_seasonality(heat, path):
     plt.figure(figsize=(10,4))
     sns.heatmap(heat, cmap='YlOrRd', cbar_kws={'label':'Incidents'})
     plt.title('Seasonality (Hour x Month)')
     plt.xlabel('Month')
     plt.ylabel('Hour of Day')
     plt.tight_layout()
-    plt.savefig(charts_dir/'seasonality_heat.png')
+    plt.savefig(path)
     plt.close()
 
-    # 9. Static density map (scatter)
-    if 'lat' in df.columns and 'lon' in df.columns:
-        plt.figure(figsize=(10,10))
-        plt.scatter(df['lon'], df['lat'], s=2, alpha=0.3)
-        plt.title('Incident Locations (All Types)')
-        plt.xlabel('Longitude')
-        plt.ylabel('Latitude')
-        plt.tight_layout()
-        plt.savefig(charts_dir/'static_density_map.png')
-        plt.close()
-        # By type (top 4 types)
-        if 'nature_grp' in df.columns:
-            top_types = df['nature_grp'].value_counts().index[:4]
-            for t in top_types:
-                plt.figure(figsize=(10,10))
-                sub = df[df['nature_grp']==t]
-                plt.scatter(sub['lon'], sub['lat'], s=4, alpha=0.4)
-                plt.title(f'Incident Locations: {t}')
-                plt.xlabel('Longitude')
-                plt.ylabel('Latitude')
-                plt.tight_layout()
-                plt.savefig(charts_dir/f'static_density_{t}.png')
-                plt.close()
+def plot_density(cells, path, title, grid, bandwidth_m=BANDWIDTH_M):
+    """Kernel density surface of grid cells with the top peaks circled."""
+    grid = Grid(**grid)
+    surface, ix0, iy0 = density(cells, grid, bandwidth_m)
+    peaks = find_peaks(cells, grid, 5, bandwidth_m)
+    plt.figure(figsize=(10,10))
+    plt.imshow(surface, origin='lower', extent=surface_extent(surface, ix0, iy0, grid), cmap='YlOrRd',
+               aspect=1 / np.cos(np.radians(grid.ref_lat)))
+    plt.colorbar(label='Smoothed incidents per cell', shrink=0.7)
+    plt.scatter(peaks['lon'], peaks['lat'], s=30, facecolors='none', edgecolors='black')
+    plt.title(title)
+    plt.xlabel('Longitude')
+    plt.ylabel('Latitude')
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close()
+
+
+def chart_tasks(cube, hotspots, summary):
+    """Return the ChartTasks to render.
+
+    One-way counts come from summary (see summary.py), cross-tabs are
+    slices of the count cube and density maps come from hotspots, a
+    HotspotIndex.
+    """
+    def counts(by):
+        return cube.groupby(by, observed=True)['incidents'].sum()
+
+    def series(name, key):
+        return table(summary, name).set_index(key)['incidents']
+
+    tasks = []
+
+    # 1. Incidents per year
+    yearly = table(summary, 'by_year')[['year', 'incidents']]
+    tasks.append(ChartTask('yearly_trend.png', plot_yearly, yearly))
+
+    # 2. Incidents per month
+    monthly = table(summary, 'by_month')
+    tasks.append(ChartTask('monthly_trend.png', plot_monthly, monthly))
+
+    # 3. Incidents by day of week
+    dow = series('by_dow', 'dow')
+    tasks.append(ChartTask('dow_bar.png', plot_counts_bar, dow, title='Incidents by Day of Week',
+                           xlabel='Day of Week', figsize=(7,4),
+                           xticklabels=('Mon','Tue','Wed','Thu','Fri','Sat','Sun')))
+
+    # 4. Incidents by hour
+    hour_counts = series('by_hour', 'hour')
+    tasks.append(ChartTask('hour_bar.png', plot_counts_bar, hour_counts, title='Incidents by Hour of Day',
+                           xlabel='Hour', figsize=(7,4)))
+
+    # 5. Incident type distribution (pie and bar)
+    type_counts = series('by_nature', 'nature')
+    tasks.append(ChartTask('type_pie.png', plot_type_pie, type_counts))
+    tasks.append(ChartTask('type_bar.png', plot_series_bar, type_counts, title='Incident Type Distribution (Bar)',
+                           xlabel='Type', figsize=(10,5)))
+
+    # 6. Yearly trend by incident type (already present as stack)
+    stack_pivot = counts(['year','nature_grp']).unstack(fill_value=0)
+    stack_pivot = stack_pivot.div(stack_pivot.sum(axis=1), axis=0)
+    tasks.append(ChartTask('type_stack.png', plot_type_stack, stack_pivot))
+
+    # 7. Incident type by month (heatmap)
+    month_type = counts(['month','nature_grp']).unstack(fill_value=0)
+    tasks.append(ChartTask('type_by_month_heat.png', plot_type_by_month, month_type))
+
+    # 8. Seasonality heatmap (hour x month) (already present)
+    heat = counts(['hour','month']).unstack(fill_value=0)
+    tasks.append(ChartTask('seasonality_heat.png', plot_seasonality, heat))
+
+    # 9. Static density maps (kernel density over the hotspot grid)
+    if hotspots is not None and len(hotspots.bins):
+        grid = hotspots.grid.to_dict()
+        # All types, then by type (top 4 types)
+        group_totals = hotspots.bins.groupby('nature_grp', observed=True)['incidents'].sum()
+        maps = [(None, 'Incident Density (All Types)', 'static_density_map.png')]
+        maps += [([t], f'Incident Density: {t}', f'static_density_{t}.png')
+                 for t in group_totals.sort_values(ascending=False).index[:4]]
+        for groups, title, filename in maps:
+            cells = hotspots.select(groups=groups)
+            if len(cells):
+                tasks.append(ChartTask(filename, plot_density, cells, deps=(spatial,), title=title, grid=grid))
 
     # 10. Incidents by area/neighborhood (bar)
-    if 'area' in df.columns:
-        area_counts = df['area'].value_counts().sort_values(ascending=False)
-        plt.figure(figsize=(8,4))
-        area_counts.plot.bar()
-        plt.title('Incidents by Area/Neighborhood')
-        plt.xlabel('Area/Neighborhood')
-        plt.ylabel('Incidents')
-        plt.tight_layout()
-        plt.savefig(charts_dir/'area_bar.png')
-        plt.close()
+    area_counts = series('by_area', 'area')
+    tasks.append(ChartTask('area_bar.png', plot_series_bar, area_counts, title='Incidents by Area/Neighborhood',
+                           xlabel='Area/Neighborhood', figsize=(8,4)))
 
     # 11. Top 10 most common addresses
-    if 'address' in df.columns:
-        addr_counts = df['address'].value_counts().head(10)
-        plt.figure(figsize=(8,4))
-        addr_counts.plot.bar()
-        plt.title('Top 10 Most Common Addresses')
-        plt.xlabel('Address')
-        plt.ylabel('Incidents')
-        plt.tight_layout()
-        plt.savefig(charts_dir/'top10_addresses.png')
-        plt.close()
+    top_addresses = series('top_addresses', 'address') if summary['top_addresses'] else None
+    if top_addresses is not None:
+        tasks.append(ChartTask('top10_addresses.png', plot_series_bar, top_addresses.head(10),
+                               title='Top 10 Most Common Addresses', xlabel='Address', figsize=(8,4)))
+
+    return tasks
+
 
+def build_charts(df, charts_dir, hotspots=None, workers=1, force=False):
+    """Render the static charts for df (see render_charts)."""
+    if hotspots is None:
+        hotspots = HotspotIndex.from_frame(df)
+    cube = build_cube(df)
+    render_charts(cube, hotspots, summarize(df, cube), charts_dir, workers, force)
+
+
+def render_charts(cube, hotspots, summary, charts_dir, workers=1, force=False):
+    """Render the static charts from aggregates, skipping those whose input hash is unchanged."""
+    charts_dir = Path(charts_dir)
+    charts_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = charts_dir / CHART_MANIFEST
+    manifest = {} if force or not manifest_path.exists() else json.loads(manifest_path.read_text())
+
+    tasks = chart_tasks(cube, hotspots, summary)
+    keys = {task.filename: task.key() for task in tasks}
+    todo = [t for t in tasks if manifest.get(t.filename) != keys[t.filename] or not (charts_dir/t.filename).exists()]
+    logging.info(f'Charts: {len(tasks) - len(todo)} unchanged, {len(todo)} to render')
+    count('charts.skipped', len(tasks) - len(todo))
+    count('charts.rendered', len(todo))
+
+    done = {name: key for name, key in keys.items() if manifest.get(name) == key}
+    try:
+        if workers > 1 and len(todo) > 1:
+            # forkserver: build_charts may run next to other pipeline stages on threads
+            context = multiprocessing.get_context('forkserver')
+            with ProcessPoolExecutor(max_workers=min(workers, len(todo)), mp_context=context) as pool:
+                futures = [pool.submit(capture, _render, task, charts_dir) for task in todo]
+                for future in as_completed(futures):
+                    name, snap = future.result()
+                    METRICS.merge(snap)
+                    done[name] = keys[name]
+        else:
+            for task in todo:
+                done[_render(task, charts_dir)] = keys[task.filename]
+    finally:
+        manifest_path.write_text(json.dumps(done, indent=2, sort_keys=True))
     logging.info('Charts saved to %s', charts_dir)
 
 def build_heatmap(df, maps_dir):
+    # Markers and heat points are aggregated per location; see maps.py
+    write_heatmap(map_layers(df), maps_dir)
+
+def write_heatmap(layers, maps_dir):
+    """Write hotspots.html from map layers (maps.map_layers / layers_from_counts)."""
     maps_dir = Path(maps_dir)
     maps_dir.mkdir(parents=True, exist_ok=True)
-    # Filter out rows with missing lat/lon
-    map_df = df.dropna(subset=['lat','lon'])
-    # Center map on median
-    m = folium.Map(location=[map_df['lat'].median(), map_df['lon'].median()], zoom_start=13)
-    # Add fullscreen button
-    from folium.plugins import Fullscreen
-    Fullscreen().add_to(m)
-    # Add heatmap
-    hm = HeatMap(
-        data=map_df[['lat','lon']].values,
-        radius=10, blur=7, min_opacity=0.4, max_zoom=1,
-    )
-    hm.add_to(m)
-    # Add interactive marker cluster for details
-    from folium.plugins import MarkerCluster
-    marker_cluster = MarkerCluster().add_to(m)
-    for _, row in map_df.iterrows():
-        popup = folium.Popup(f"<b>Date:</b> {row['reported_dt']}<br><b>Type:</b> {row['nature']}<br><b>Address:</b> {row['address']}", max_width=300)
-        folium.Marker(
-            location=[row['lat'], row['lon']],
-            popup=popup,
-            tooltip=row['nature']
-        ).add_to(marker_cluster)
-    # Add year/type filter UI (simple dropdowns)
-    folium.LayerControl().add_to(m)
-    m.save(str(maps_dir/'hotspots.html'))
+    page = cached_layers_html(layers, maps_dir / '.cache', label='nature')
+    (maps_dir/'hotspots.html').write_text(page)
     logging.info('Hotspot map saved to %s', maps_dir/'hotspots.html')